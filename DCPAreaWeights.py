@@ -0,0 +1,92 @@
+import os
+import hashlib
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from shapely.geometry import box
+
+
+class DCPAreaWeights:
+    def __init__(self, grid_ids, indptr, indices, weights, n_pixels):
+        # CSR layout: the source pixels of cell i are indices[indptr[i]:indptr[i + 1]]
+        self.grid_ids = grid_ids
+        self.indptr = indptr
+        self.indices = indices
+        self.weights = weights
+        self.n_pixels = n_pixels
+
+    @classmethod
+    def load_or_build(cls, directory, src_transform, src_shape, src_crs):
+        # Weights depend only on the grid and the source raster geometry, so they are built once per province;
+        # the grid file's modification time and cell count are part of the key so a regenerated grid gets new weights
+        grid_path = f"{directory}/clippedGrid.shp"
+        n_cells = len(gpd.read_file(grid_path, ignore_geometry=True))
+        key = hashlib.md5(repr((tuple(src_transform)[:6], tuple(src_shape), str(src_crs),
+                                os.path.getmtime(grid_path), n_cells)).encode()).hexdigest()[:12]
+        cache_path = f"{directory}/area_weights_{key}.npz"
+        if os.path.exists(cache_path):
+            return cls.load(cache_path)
+
+        weights = cls.build(gpd.read_file(grid_path), src_transform, src_shape, src_crs)
+        weights.save(cache_path)
+        return weights
+
+    @classmethod
+    def build(cls, grid, src_transform, src_shape, src_crs):
+        height, width = src_shape
+
+        # Footprint of every source pixel, projected to the grid CRS
+        rows, cols = np.divmod(np.arange(height * width), width)
+        xs0, ys0 = src_transform * (cols, rows)
+        xs1, ys1 = src_transform * (cols + 1, rows + 1)
+        pixels = gpd.GeoDataFrame(
+            {"pixel": np.arange(height * width)},
+            geometry=[box(min(a, c), min(b, d), max(a, c), max(b, d)) for a, b, c, d in zip(xs0, ys0, xs1, ys1)],
+            crs=src_crs,
+        ).to_crs(grid.crs)
+
+        # Area of every (cell, pixel) overlap, normalised per cell
+        overlap = gpd.overlay(grid[["id", "geometry"]], pixels, how="intersection", keep_geom_type=True)
+        overlap["area"] = overlap.geometry.area
+        overlap = overlap[overlap["area"] > 0].sort_values(["id", "pixel"])
+
+        grid_ids = grid["id"].to_numpy()
+        row_of_cell = pd.Index(grid_ids).get_indexer(overlap["id"])  # Grid row of every overlap
+        sort = np.argsort(row_of_cell, kind="stable")
+        row_of_cell = row_of_cell[sort]
+        indices = overlap["pixel"].to_numpy()[sort].astype(np.int64)
+        areas = overlap["area"].to_numpy()[sort]
+
+        counts = np.bincount(row_of_cell, minlength=len(grid_ids))
+        indptr = np.concatenate([[0], np.cumsum(counts)])
+        totals = np.repeat(np.add.reduceat(areas, indptr[:-1][counts > 0]), counts[counts > 0])
+        return cls(grid_ids, indptr, indices, areas / totals, height * width)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data["grid_ids"], data["indptr"], data["indices"], data["weights"], int(data["n_pixels"]))
+
+    def save(self, path):
+        np.savez(path, grid_ids=self.grid_ids, indptr=self.indptr, indices=self.indices,
+                 weights=self.weights, n_pixels=self.n_pixels)
+
+    def apply(self, cube):
+        # (days, rows, cols) -> (cells, days) area-weighted means, one sparse product for all days
+        values = cube.reshape(cube.shape[0], self.n_pixels)[:, self.indices]  # (days, nnz)
+        valid = ~np.isnan(values)
+        weighted = np.where(valid, values, 0) * self.weights
+        weight_sum = valid * self.weights
+
+        counts = np.diff(self.indptr)
+        has_pixels = counts > 0
+        starts = self.indptr[:-1][has_pixels]
+
+        # Renormalise over the valid pixels so missing source data does not bias the mean
+        out = np.full((len(self.grid_ids), cube.shape[0]), np.nan, dtype=np.float32)
+        if len(starts):
+            sums = np.add.reduceat(weighted, starts, axis=1)
+            norms = np.add.reduceat(weight_sum, starts, axis=1)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                out[has_pixels] = (sums / norms).T
+        return out
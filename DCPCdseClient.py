@@ -0,0 +1,148 @@
+import os
+import json
+import time
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from dotenv import load_dotenv
+from DCPConstants import DCPConstants
+
+
+class DCPCdseClient:
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, client_id=None, client_secret=None, token_cache=DCPConstants.CDSE_TOKEN_CACHE):
+        load_dotenv()
+        self.client_id = client_id or os.getenv("CLIENT_ID")
+        self.client_secret = client_secret or os.getenv("CLIENT_SECRET")
+        self.token_cache = token_cache
+        self.token = None
+        self._token_lock = threading.Lock()
+        self.session = self.build_session()
+
+    @staticmethod
+    def build_session():
+        # One keep-alive session, with retry and backoff on throttling and server errors
+        retry = Retry(
+            total=DCPConstants.CDSE_RETRIES,
+            backoff_factor=DCPConstants.CDSE_BACKOFF,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset(["GET", "POST"]),
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=DCPConstants.CDSE_POOL_SIZE, max_retries=retry)
+        session = requests.Session()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    @classmethod
+    def shared(cls):
+        # Process wide instance so every module reuses the same token and connection pool
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls()
+            return cls._shared
+
+    def get_token(self):
+        with self._token_lock:
+            if not self.token_valid(self.token):
+                self.token = self.read_cached_token()
+            if not self.token_valid(self.token):
+                self.token = self.fetch_token()
+                self.write_cached_token(self.token)
+            return self.token
+
+    def token_valid(self, token):
+        return bool(token) and token.get("expires_at", 0) - DCPConstants.CDSE_TOKEN_MARGIN > time.time()
+
+    def fetch_token(self):
+        response = self.session.post(
+            DCPConstants.CDSE_TOKEN_URL,
+            data={
+                "grant_type": "client_credentials",
+                "client_id": self.client_id,
+                "client_secret": self.client_secret,
+            },
+            timeout=DCPConstants.CDSE_TIMEOUT,
+        )
+        response.raise_for_status()
+        token = response.json()
+        token["expires_at"] = time.time() + token.get("expires_in", 0)
+        return token
+
+    def read_cached_token(self):
+        # Tokens are shared between processes through a small cache file
+        if not self.token_cache or not os.path.exists(self.token_cache):
+            return None
+        try:
+            with open(self.token_cache) as f:
+                token = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if token.get("client_id") != self.client_id:
+            return None
+        return token
+
+    def write_cached_token(self, token):
+        if not self.token_cache:
+            return
+        cached = dict(token, client_id=self.client_id)
+        tmp_path = f"{self.token_cache}.{os.getpid()}.tmp"
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as f:
+            json.dump(cached, f)
+        os.replace(tmp_path, self.token_cache)
+
+    def invalidate_token(self):
+        with self._token_lock:
+            self.token = None
+            if self.token_cache and os.path.exists(self.token_cache):
+                os.remove(self.token_cache)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", DCPConstants.CDSE_TIMEOUT)
+        headers = dict(kwargs.pop("headers", {}) or {})
+        headers["Authorization"] = f"Bearer {self.get_token()['access_token']}"
+        response = self.session.request(method, url, headers=headers, **kwargs)
+
+        # The cached token may have been revoked, refresh it once and try again
+        if response.status_code == 401:
+            self.invalidate_token()
+            headers["Authorization"] = f"Bearer {self.get_token()['access_token']}"
+            response = self.session.request(method, url, headers=headers, **kwargs)
+        return response
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def sh_config(self):
+        from sentinelhub import SHConfig
+
+        config = SHConfig()
+        config.sh_client_id = self.client_id
+        config.sh_client_secret = self.client_secret
+        config.sh_base_url = DCPConstants.CDSE_BASE_URL
+        config.sh_token_url = DCPConstants.CDSE_TOKEN_URL
+        config.max_download_attempts = DCPConstants.CDSE_RETRIES
+        return config
+
+    def sh_download(self, request):
+        # Run a sentinelhub-py request over the pooled session: sentinelhub-py's own download client opens
+        # new connections with its own retry rules, this reuses the keep-alive pool, the retry adapter
+        # and the shared token
+        from sentinelhub.decoding import decode_data
+
+        results = []
+        for download in request.download_list:
+            response = self.request(download.request_type.value, download.url, json=download.post_values,
+                                    headers=download.headers)
+            response.raise_for_status()
+            results.append(decode_data(response.content, download.data_type))
+        return results
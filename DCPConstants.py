@@ -25,6 +25,10 @@ class DCPConstants:
 
     GRID_SIZE=(10000, 10000) #In meters
 
+    # Optional nested grid sizes in meters, e.g. [1000, 2000, 5000, 10000, 20000]. When set, features are
+    # extracted once on the finest grid and aggregated to every coarser level; GRID_SIZE is then unused.
+    GRID_PYRAMID=[]
+
     RESOLUTION=1000 #In meters per pixel, max 1500 meters per pixel allowed (For NDVI and DEM)
 
     MONTHS_DICT={"January":"01",
@@ -40,5 +44,84 @@ class DCPConstants:
                  "November": "11",
                  "December": "12"}
 
-    FEATURES_LIST=["Temperature", "Total Precipitation", "Average Wind Speed", "Relative Humidity",
-                   "Slope", "Aspect", "Elevation", "NDVI"]
\ No newline at end of file
+    CDSE_BASE_URL="https://sh.dataspace.copernicus.eu"
+    CDSE_TOKEN_URL="https://identity.dataspace.copernicus.eu/auth/realms/CDSE/protocol/openid-connect/token"
+    CDSE_TOKEN_CACHE=".cdse_token.json" # Shared by every process started from the same directory
+    CDSE_TOKEN_MARGIN=60 # Refresh the token this many seconds before it expires
+    CDSE_RETRIES=5
+    CDSE_BACKOFF=1.0 # Seconds, doubled after every retry
+    CDSE_POOL_SIZE=16
+    CDSE_TIMEOUT=300 # Seconds
+
+    ERA5_SAMPLING="centroid" # "centroid" samples the pixel under each cell centroid, "area" takes the area-weighted mean
+
+    ERA5_SOURCE="province" # "national" crops every province from one cached Canada-wide cube per variable-month
+    ERA5_NATIONAL_DIR="Canada_ERA5"
+
+    APPEND_MODE=False # Keep (month, feature) partitions and only compute the ones missing from Final_Dataset_{year}
+
+    CUBE_CHUNK_CELLS=2000 # Grid cells per export chunk of the datacube
+
+    PIPELINE_DEPTH=2 # Downloads (ERA5 variables, NDVI weeks/periods) held ahead of processing, caps memory and disk
+    PIPELINE_FETCHERS=1 # Concurrent downloads per producer
+    PIPELINE_WORKERS=2 # Threads decoding and sampling downloaded chunks
+
+    EXPORT_PARQUET=True # Also write Final_Dataset_{year}.parquet for DCPQuery, needs pyarrow
+
+    SAMPLER_BATCH_SIZE=1024 # Cell-days per DCPSampler training batch
+    SAMPLER_NEGATIVE_RATIO=3 # Non-ignition cell-days drawn per ignition
+    SAMPLER_REGION_CELLS=10 # Side, in grid cells, of the regions negatives are stratified by
+
+    FIRE_WEATHER_WINDOWS=[7, 14, 30] # Trailing windows (days) of the rolling precipitation sums
+    FIRE_WEATHER_LAGS=[7, 14] # NDVI lags (days)
+    FIRE_WEATHER_SPIN_UP=60 # Days computed before the first selected date so windows fill and FWI codes settle
+
+    FIRE_HISTORY_YEARS=[1, 5, 10] # Trailing windows (years) of the per-cell and neighbourhood fire counts
+
+    DEM_SOURCE="remote" # "mirror" reads a local copy of the Copernicus GLO-30 COG tiles instead of the process API
+    DEM_MIRROR_DIR="" # Directory of the GLO-30 tiles (Copernicus_DSM_COG_10_..._DEM.tif, optionally one folder per tile)
+    DEM_MIRROR_RESOLUTION=None # Meters per pixel read from the mirror, defaults to RESOLUTION; 30 reads full resolution
+    DEM_MIRROR_WORKERS=8 # Threads reading tile headers and DEM blocks
+    DEM_MIRROR_BLOCK_ROWS=256 # Output rows per parallel read
+
+    MAP_OVERVIEW_SIZE=256 # Map preview overviews are halved until their longest side fits this many cells
+
+    NDVI_BACKEND="process" # "statistics" requests per-cell weekly mean, std and valid pixel count instead of images
+    NDVI_ENCODING="float32" # "int16" or "uint8" send scaled NDVI in one band with a no-data value, 2-4x less to transfer
+    NDVI_MULTITEMPORAL=None # "month" or "season" fetches all weekly cloud-masked composites in one request per period
+    NDVI_STATS_URL=None # Statistical API endpoint, defaults to CDSE_BASE_URL; requests still carry the CDSE token
+    NDVI_STATS_UNAUTHENTICATED=False # Send statistics requests without the CDSE token, only for a local stand-in endpoint
+    NDVI_STATS_WORKERS=8 # Concurrent statistics requests
+    NDVI_STATS_BATCH=500 # Requests per progress/profiling batch
+
+    WARM_UP_IMPORTS=True # Import the pipeline modules in a background thread after the window is shown
+
+    PROFILE_TRACE=False # Also write a Chrome trace (run_trace.json) next to run_report.json
+    PROFILE_STAGES=[] # Stage names to run under cProfile, "*" for every stage
+
+    FEATURES_LIST=["Temperature", "Total Precipitation", "Average Wind Speed", "Wind Direction",
+                   "Relative Humidity", "Vapour Pressure Deficit", "Slope", "Aspect", "Elevation", "NDVI",
+                   "Rolling Precipitation", "Temperature Anomaly", "Fire Weather Index", "Lagged NDVI",
+                   "Days Since Fire", "Fire History", "Neighbourhood Fire History"]
+
+    # Columns each feature writes to the dataset; NDVI_std and NDVI_count only come from the statistics backend
+    FEATURE_COLUMNS={
+        "Temperature": ["T"],
+        "Total Precipitation": ["Prcp"],
+        "Average Wind Speed": ["Ws"],
+        "Wind Direction": ["Wd"],
+        "Relative Humidity": ["RelHum"],
+        "Vapour Pressure Deficit": ["VPD"],
+        "Slope": ["slope"],
+        "Aspect": ["aspect"],
+        "Elevation": ["elevation"],
+        "NDVI": ["NDVI", "NDVI_std", "NDVI_count"],
+        "Rolling Precipitation": [f"Prcp_{window}d" for window in FIRE_WEATHER_WINDOWS],
+        "Temperature Anomaly": ["T_anom"],
+        "Fire Weather Index": ["FFMC", "DMC", "DC", "ISI", "BUI", "FWI"],
+        "Lagged NDVI": [f"LagNDVI_{lag}d" for lag in FIRE_WEATHER_LAGS],
+        "Days Since Fire": ["DaysSinceFire"],
+        "Fire History": [f"Fires_{years}y" for years in FIRE_HISTORY_YEARS],
+        "Neighbourhood Fire History": [f"NbrFires_{years}y" for years in FIRE_HISTORY_YEARS],
+        "Fire": ["ignition"],
+    }
\ No newline at end of file
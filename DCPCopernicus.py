@@ -1,101 +1,241 @@
 import os.path
+import calendar
+import threading
 import cdsapi
 import geopandas as gpd
 import rasterio
-import pandas as pd
 import numpy as np
-from datetime import datetime, timedelta
 from rasterio.warp import calculate_default_transform, reproject, Resampling
+from rasterio.transform import rowcol
+from affine import Affine
 from DCPConstants import DCPConstants
 from DCPHelper import DCPHelper
+from DCPProfiler import DCPProfiler
+from DCPAreaWeights import DCPAreaWeights
+from DCPRasterStore import DCPRasterStore
+from DCPPipeline import DCPPipeline
 
 class DCPCopernicus:
-    def __init__(self, province, year, months, features):
+    # ERA5 single level variables, keyed by the short name of their band cube
+    ERA5_VARIABLES = {
+        "T": "2m_temperature",
+        "Prcp": "total_precipitation",
+        "unorm": "10m_u_component_of_wind",
+        "vnorm": "10m_v_component_of_wind",
+        "dew": "2m_dewpoint_temperature",
+    }
+
+    # Feature -> (output column, input cubes, method evaluated element-wise on the aligned cubes)
+    FEATURES = {
+        "Temperature": ("T", ["T"], None),
+        "Total Precipitation": ("Prcp", ["Prcp"], None),
+        "Average Wind Speed": ("Ws", ["unorm", "vnorm"], "wind_speed"),
+        "Wind Direction": ("Wd", ["unorm", "vnorm"], "wind_direction"),
+        "Relative Humidity": ("RelHum", ["T", "dew"], "relative_humidity"),
+        "Vapour Pressure Deficit": ("VPD", ["T", "dew"], "vapour_pressure_deficit"),
+    }
+
+    # Methods deriving a direction from vector components, which must not be averaged as angles
+    VECTOR_METHODS = {"wind_direction"}
+
+    # Decoded Canada-wide cubes, keyed by (variable, year, month) and shared by every province in the process
+    _national_cache = {}
+    _national_lock = threading.Lock()
+
+    def __init__(self, province, year, months, features, profiler=None, sampling=DCPConstants.ERA5_SAMPLING,
+                 source=DCPConstants.ERA5_SOURCE):
         self.province=province
         self.year=year
         self.months=[DCPConstants.MONTHS_DICT[month] for month in months]
         self.features=features
+        self.sampling=sampling  # "centroid" or "area"
+        self.source=source  # "province" or "national"
         self.directory = self.province.replace(" ", "_")
+        self.profiler = profiler or DCPProfiler(self.directory, enabled=False)
+        self.store = DCPRasterStore(self.directory)
 
     def generate_dataset(self):
-        all_df=[]
-        temp_df=pd.DataFrame()
-        if "Temperature" in self.features:
-            self.generate_grib('2m_temperature')
-            self.reproject_raster()
-            temp_df=self.sample_data('T')
-            all_df.append(temp_df)
-
-        if "Total Precipitation" in self.features:
-            self.generate_grib('total_precipitation')
-            self.reproject_raster()
-            prcp_df=self.sample_data('Prcp')
-            all_df.append(prcp_df)
-
-        if "Average Wind Speed" in self.features:
-            # Generate the u component of wind values
-            self.generate_grib('10m_u_component_of_wind')
-            self.reproject_raster()
-            unorm_df=self.sample_data('unorm')
-
-            # Generate the v component of wind values
-            self.generate_grib('10m_v_component_of_wind')
-            self.reproject_raster()
-            vnorm_df=self.sample_data('vnorm')
-
-            # Merge the 2 dataframes and calculate average wind speed
-            ws_df=DCPHelper.merge('inner',unorm_df,vnorm_df)
-            ws_df['Ws']=np.sqrt(ws_df['unorm']**2 + ws_df['vnorm']**2)
-            ws_df = ws_df.drop(columns=['unorm', 'vnorm'])
-            all_df.append(ws_df)
-
-        if "Relative Humidity" in self.features:
-            if temp_df.empty:
-                self.generate_grib('2m_temperature')
-                self.reproject_raster()
-                temp_df = self.sample_data('T')
-            self.generate_grib('2m_dewpoint_temperature')
-            self.reproject_raster()
-            dew_temp_df = self.sample_data('dew')
-            rel_hum_df = DCPHelper.merge('inner', temp_df, dew_temp_df) # Combine temperature and dewpoint temperature
-
-            # Calculate saturation vapor pressure at temperature and dewpoint temperature
-            # Note: Temperatures need to be converted to Celsius
-            es_dew_temp = np.exp(17.625 * (rel_hum_df['dew'] - 273.15) / (rel_hum_df['dew'] - 30.11))
-            es_temp = np.exp(17.625 * (rel_hum_df['T'] - 273.15) / (rel_hum_df['T'] - 30.11))
-
-            # Calculate Relative Humidity
-            rel_hum_df['RelHum'] = (es_dew_temp / es_temp) * 100
-            rel_hum_df=rel_hum_df.drop(columns=['dew','T'])
-            all_df.append(rel_hum_df)
-
-        merged_df=DCPHelper.merge('outer',all_df) #merge all resulting dataframes
-        return merged_df
-
-    def generate_grib(self, variable):
+        grid_ids, arrays = self.generate_arrays()
+        return DCPHelper.to_long(grid_ids, self.generate_dates(), arrays)
+
+    def register(self, cube):
+        cube.add_source(self.generate_arrays)
+
+    def generate_arrays(self):
+        selected = [feature for feature in self.FEATURES if feature in self.features]
+
+        # Decode every raw variable once, in request order, as one memory-mapped cube per month.
+        # The next variable downloads while the previous one is warped and decoded.
+        names = []
+        for feature in selected:
+            names += [name for name in self.FEATURES[feature][1] if name not in names]
+        pipeline = DCPPipeline(self.fetch_variable, self.read_variable)
+        results = pipeline.run([self.ERA5_VARIABLES[name] for name in names])
+        cubes = {name: month_cubes for name, (month_cubes, _) in zip(names, results)}
+
+        # Georeferencing of every month, kept once the workers are done. Variables of the same month come
+        # from the same download or crop, so they must share it.
+        self.month_grids = results[0][1]
+        for name, (_, month_grids) in zip(names, results):
+            if month_grids != self.month_grids:
+                raise ValueError(f"ERA5 {name} is not on the same grid as {names[0]}")
+
+        # Evaluate the derived features on the band cubes, then sample each one once.
+        # Area-weighted directions average the vector components first and are derived after sampling.
+        derived, deferred = {}, {}
+        with self.profiler.stage("era5_derive"):
+            for feature in selected:
+                column, inputs, method = self.FEATURES[feature]
+                if method is None:
+                    derived[column] = cubes[inputs[0]]
+                elif method in self.VECTOR_METHODS and self.sampling == "area":
+                    deferred[column] = (inputs, method)
+                    for name in inputs:
+                        derived[f"_{name}"] = cubes[name]
+                else:
+                    derived[column] = [getattr(self, method)(*month_cubes)
+                                       for month_cubes in zip(*[cubes[name] for name in inputs])]
+        cubes.clear()
+
+        grid_ids, arrays = self.sample_data(derived)
+        for column, (inputs, method) in deferred.items():
+            arrays[column] = getattr(self, method)(*[arrays[f"_{name}"] for name in inputs])
+        return grid_ids, {column: array for column, array in arrays.items() if not column.startswith("_")}
+
+    def store_grid(self):
+        # Province downloads sampled at centroids are warped to the grid CRS, everything else stays native.
+        # Native province downloads and national crops have different extents, so they are stored apart.
+        if self.source == "province":
+            return "warped" if self.sampling == "centroid" else "province"
+        return "national"
+
+    def fetch_variable(self, variable):
+        # Network part: download the months missing from the raster store, one grib per variable
+        missing = [month for month in self.months if not self.store.has(variable, self.year, month, self.store_grid())]
+        if missing and self.source == "national":
+            for month in missing:
+                self.national_grib(variable, month)
+            return missing, None
+        if missing:
+            path = f"{self.directory}/Dataset_{variable}.grib"
+            self.generate_grib(variable, missing, target_path=path)
+            return missing, path
+        return missing, None
+
+    def read_variable(self, variable, fetched=None):
+        # CPU part: warp, decode and store what fetch_variable downloaded, then map every month from the store.
+        # Runs on a pipeline worker, so the georeferencing is returned rather than set on self.
+        missing, path = fetched if fetched is not None else self.fetch_variable(variable)
+        grid = self.store_grid()
+
+        if missing and self.source == "national":
+            # Cropped from the shared national cube
+            for month in missing:
+                self.store.save(variable, self.year, month, grid, *self.national_window(variable, month))
+        elif missing:
+            if grid == "warped":
+                cube, transform, crs = self.decode_raster(self.reproject_raster(path))
+            else:
+                # Area weights map the native grid straight onto the cells, no warp needed
+                cube, transform, crs = self.decode_raster(path)
+
+            # Split the multi-month cube into one stored cube per month
+            start = 0
+            for month in missing:
+                days = calendar.monthrange(int(self.year), int(month))[1]
+                self.store.save(variable, self.year, month, grid, cube[start:start + days], transform, crs)
+                start += days
+
+        month_cubes, month_grids = [], []
+        for month in self.months:
+            cube, transform, crs = self.store.load(variable, self.year, month, grid)
+            month_cubes.append(cube)
+            month_grids.append((transform, crs))
+        return month_cubes, month_grids
+
+    # Saturation vapour pressure (kPa), Magnus formula with the temperature in Kelvin
+    def saturation_vapour_pressure(self, temp):
+        return 0.61094 * np.exp(17.625 * (temp - 273.15) / (temp - 30.11))
+
+    def wind_speed(self, u, v):
+        return np.hypot(u, v)
+
+    def wind_direction(self, u, v):
+        # Meteorological convention: direction the wind blows from, clockwise from north
+        return (180 + np.degrees(np.arctan2(u, v))) % 360
+
+    def relative_humidity(self, temp, dew):
+        return self.saturation_vapour_pressure(dew) / self.saturation_vapour_pressure(temp) * 100
+
+    def vapour_pressure_deficit(self, temp, dew):
+        return self.saturation_vapour_pressure(temp) - self.saturation_vapour_pressure(dew)
+
+    def generate_grib(self, variable, months=None, area=None, target_path=None):
         client = cdsapi.Client()
         dataset = "reanalysis-era5-single-levels"
         request_params = {
             'product_type': 'reanalysis',
             'variable': variable,
             'year': self.year,
-            'month': self.months,  # List of months
+            'month': months or self.months,  # List of months
             'day': [f"{i:02}" for i in range(1, 32)],  # All days in each month
             'time': '12:00',
             'format': 'grib',
-            'area': DCPConstants.PROVINCE_DICT[self.province]
+            'area': area or DCPConstants.PROVINCE_DICT[self.province]
         }
 
-        target_path=f"{self.directory}/Dataset.grib"
+        target_path=target_path or f"{self.directory}/Dataset.grib"
         # Delete the previous grib file (if it exists)
         if os.path.exists(target_path):
             os.remove(target_path)
 
-        client.retrieve(dataset, request_params, target_path)
-
-    def reproject_raster(self):
+        with self.profiler.stage(f"era5_download:{variable}") as stage:
+            client.retrieve(dataset, request_params, target_path)
+            stage.add_bytes(os.path.getsize(target_path))
+
+    def national_area(self):
+        # Union of all provincial boxes, [North, West, South, East]
+        boxes = DCPConstants.PROVINCE_DICT.values()
+        return [max(b[0] for b in boxes), min(b[1] for b in boxes), min(b[2] for b in boxes), max(b[3] for b in boxes)]
+
+    def national_grib(self, variable, month):
+        # One download per variable-month, cached on disk and shared by every province
+        os.makedirs(DCPConstants.ERA5_NATIONAL_DIR, exist_ok=True)
+        path = f"{DCPConstants.ERA5_NATIONAL_DIR}/{variable}_{self.year}_{month}.grib"
+        if not os.path.exists(path):
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.part"
+            self.generate_grib(variable, [month], self.national_area(), tmp_path)
+            os.replace(tmp_path, path)
+        return path
+
+    def national_month(self, variable, month):
+        # Decoded once per process; the download happens outside the lock so it can overlap with decoding
+        key = (variable, str(self.year), month)
+        path = self.national_grib(variable, month)
+        with self._national_lock:
+            if key not in self._national_cache:
+                self._national_cache[key] = self.decode_raster(path)
+            return self._national_cache[key]
+
+    def national_window(self, variable, month):
+        north, west, south, east = DCPConstants.PROVINCE_DICT[self.province]
+        with self.profiler.stage("era5_crop") as stage:
+            cube, transform, crs = self.national_month(variable, month)
+
+            # Pixel window covering the provincial box, rounded outwards
+            cols, rows = zip(~transform * (west, north), ~transform * (east, south))
+            row0, col0 = max(int(np.floor(min(rows))), 0), max(int(np.floor(min(cols))), 0)
+            row1, col1 = min(int(np.ceil(max(rows))), cube.shape[1]), min(int(np.ceil(max(cols))), cube.shape[2])
+            window = cube[:, row0:row1, col0:col1]
+            stage.add_rows(window.size)
+        return window, transform * Affine.translation(col0, row0), crs
+
+    def reproject_raster(self, cop_data_path=None):
+        with self.profiler.stage("era5_warp"):
+            return self._reproject_raster(cop_data_path or f"{self.directory}/Dataset.grib")
+
+    def _reproject_raster(self, cop_data_path):
         input_layer=gpd.read_file(f"{self.directory}/Province.shp")
-        cop_data_path=f"{self.directory}/Dataset.grib"
 
         target_crs = input_layer.crs
 
@@ -115,15 +255,15 @@ class DCPCopernicus:
                 'height': height
             })
 
-            # Define the path for the reprojected raster
-            self.reprojected_raster_path = f"{self.directory}/cop_reprojected.tif"
+            # Define the path for the reprojected raster, one per downloaded grib
+            reprojected_raster_path = f"{os.path.splitext(cop_data_path)[0]}_reprojected.tif"
 
             # Delete the previous reprojected raster (if it exists)
-            if os.path.exists(self.reprojected_raster_path):
-                os.remove(self.reprojected_raster_path)
+            if os.path.exists(reprojected_raster_path):
+                os.remove(reprojected_raster_path)
 
             # Reproject and save the new raster
-            with rasterio.open(self.reprojected_raster_path, 'w', **kwargs) as dst:
+            with rasterio.open(reprojected_raster_path, 'w', **kwargs) as dst:
                 for i in range(1, src.count + 1):  # Process each band in the raster
                     reproject(
                         source=rasterio.band(src, i),
@@ -134,53 +274,80 @@ class DCPCopernicus:
                         dst_crs=target_crs,
                         resampling=Resampling.bilinear  # Use bilinear resampling for continuous data
                     )
-
-    def sample_data(self, prefix):
-        rep_data = rasterio.open(self.reprojected_raster_path)
-        centroids = gpd.read_file(f"{self.directory}/centroids.shp")
-        centroids = centroids.to_crs(rep_data.crs)
-
-        # Create a list of coordinates (x, y) from the centroids GeoDataFrame
-        coord_list = [(x, y) for x, y in zip(centroids["geometry"].x, centroids["geometry"].y)]
-
-        # Sample the data at the specified coordinates
-        Temp_values = [x for x in rep_data.sample(coord_list)]
-
-        # Prepare a dictionary to store data for all days
-        temp_data = {f"{prefix}_{day + 1}": [] for day in range(len(Temp_values[0]))}
-
-        # Populate the dictionary with the values
-        for id in Temp_values:
-            for day, day_temp in enumerate(id):
-                temp_data[f"{prefix}_{day + 1}"].append(day_temp)
-
-        # Convert the dictionary to a DataFrame
-        temp_df = pd.DataFrame(temp_data)
-
-        # Concatenate the new data columns to the centroids GeoDataFrame
-        centroids = pd.concat([centroids, temp_df], axis=1)
-
-        # Save the updated GeoDataFrame as a separate dataframe
-        self.cmet_out1 = centroids.drop(columns=['geometry'])
-
-        dates=[]
-        for month in self.months:
-            date = datetime(int(self.year), int(month), 1)
-            while date.month == int(month):
-                dates.append(date)
-                date += timedelta(days=1)
-
-        all_rows = []
-        for _, row in self.cmet_out1.iterrows():
-            day = 1
-            for date in dates:
-                col = f"{prefix}_{day}"
-                new_row = {"Grid_id": row['id'], "date": date, prefix: row[col]}
-                all_rows.append(new_row)
-                day += 1
-
-        out_df = pd.DataFrame(all_rows)
-        return out_df
+        return reprojected_raster_path
+
+    def decode_raster(self, path):
+        # Decode the raster into a (days, rows, cols) cube
+        with self.profiler.stage("era5_decode") as stage:
+            with rasterio.open(path) as src:
+                cube = src.read(masked=True).astype(np.float32).filled(np.nan)
+                transform, crs = src.transform, src.crs
+            stage.add_rows(cube.size)
+        return cube, transform, crs
+
+    def generate_dates(self):
+        return DCPHelper.month_dates(self.year, self.months)
+
+    def month_days(self):
+        return [calendar.monthrange(int(self.year), int(month))[1] for month in self.months]
+
+    def sample_data(self, derived):
+        if self.sampling == "area":
+            return self.sample_area_weighted(derived)
+
+        with self.profiler.stage("era5_sample") as stage:
+            centroids = gpd.read_file(f"{self.directory}/centroids.shp")
+            shapes = [cube.shape[1:] for cube in next(iter(derived.values()))]
+
+            # Pixel containing each centroid on every month's grid, worked out once per distinct grid
+            pixels, month_pixels = {}, []
+            for (transform, crs), (height, width) in zip(self.month_grids, shapes):
+                key = (tuple(transform)[:6], crs.to_wkt(), height, width)
+                if key not in pixels:
+                    points = centroids.geometry.to_crs(crs)
+                    rows, cols = rowcol(transform, points.x, points.y)
+                    rows, cols = np.asarray(rows), np.asarray(cols)
+                    inside = (rows >= 0) & (rows < height) & (cols >= 0) & (cols < width)
+                    pixels[key] = (np.clip(rows, 0, height - 1), np.clip(cols, 0, width - 1), inside)
+                month_pixels.append(pixels[key])
+
+            n_cells, n_days = len(centroids), len(self.generate_dates())
+
+            # One (cells, days) array per feature, months sampled straight from their cubes;
+            # cells outside a month's raster are left empty
+            arrays = {}
+            for column, month_cubes in derived.items():
+                values = np.concatenate([np.where(inside, cube[:days, rows, cols], np.nan)
+                                         for cube, days, (rows, cols, inside)
+                                         in zip(month_cubes, self.month_days(), month_pixels)]).T
+                arrays[column] = np.ascontiguousarray(values, dtype=np.float32)
+
+            stage.add_cells(n_cells)
+            stage.add_rows(n_cells * n_days * len(arrays))
+        return centroids['id'].to_numpy(), arrays
+
+    def sample_area_weighted(self, derived):
+        # Area-weighted mean of the source pixels overlapping each cell
+        n_days = len(self.generate_dates())
+        with self.profiler.stage("era5_weights"):
+            # Weights of every month's grid, built once per distinct grid
+            shapes = [cube.shape[1:] for cube in next(iter(derived.values()))]
+            cache, month_weights = {}, []
+            for (transform, crs), shape in zip(self.month_grids, shapes):
+                key = (tuple(transform)[:6], crs.to_wkt(), shape)
+                if key not in cache:
+                    cache[key] = DCPAreaWeights.load_or_build(self.directory, transform, shape, crs)
+                month_weights.append(cache[key])
+            grid_ids = month_weights[0].grid_ids
+
+        with self.profiler.stage("era5_sample") as stage:
+            arrays = {}
+            for column, month_cubes in derived.items():
+                arrays[column] = np.concatenate([weights.apply(cube[:days]) for cube, days, weights
+                                                 in zip(month_cubes, self.month_days(), month_weights)], axis=1)
+            stage.add_cells(len(grid_ids))
+            stage.add_rows(len(grid_ids) * n_days * len(arrays))
+        return grid_ids, arrays
 
 
 if __name__ == "__main__":
@@ -0,0 +1,123 @@
+import os
+import shutil
+import numpy as np
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from DCPConstants import DCPConstants
+from DCPHelper import DCPHelper
+
+
+class DCPDatacube:
+    def __init__(self, grid_ids, dates, chunk_cells=DCPConstants.CUBE_CHUNK_CELLS):
+        self.grid_ids = pd.Index(np.asarray(grid_ids), name="Grid_id")
+        self.dates = pd.DatetimeIndex(dates, name="date")
+        self.chunk_cells = chunk_cells
+        self.sources = []
+        self.features = {}  # column -> (array, day_index)
+
+    def add_source(self, producer):
+        # producer() -> (grid_ids, {column: array}); only called when the cube is computed
+        self.sources.append(producer)
+
+    def add_feature(self, column, grid_ids, array, day_index=None):
+        # array is (cells,) for static features or (cells, steps) for temporal ones.
+        # day_index maps every cube date to a step, e.g. daily -> weekly, and defaults to one step per date.
+        array = self.align(grid_ids, np.asarray(array))
+        if array.ndim == 2 and day_index is None and array.shape[1] != len(self.dates):
+            raise ValueError(f"{column} has {array.shape[1]} days, the cube has {len(self.dates)}")
+        self.features[column] = (array, None if day_index is None else np.asarray(day_index))
+
+    def align(self, grid_ids, array):
+        # Reorder producer rows to the cube's Grid_id order; missing cells become NaN
+        grid_ids = pd.Index(np.asarray(grid_ids))
+        if grid_ids.equals(self.grid_ids):
+            return array
+        indexer = grid_ids.get_indexer(self.grid_ids)
+        out = np.full((len(self.grid_ids),) + array.shape[1:], np.nan, dtype=np.result_type(array.dtype, np.float32))
+        found = indexer >= 0
+        out[found] = array[indexer[found]]
+        return out
+
+    def compute(self):
+        for producer in self.sources:
+            grid_ids, arrays = producer()
+            for column, array in arrays.items():
+                if isinstance(array, tuple):
+                    self.add_feature(column, grid_ids, *array)
+                else:
+                    self.add_feature(column, grid_ids, array)
+        self.sources = []
+        return self
+
+    def chunk(self, start, stop, days=slice(None)):
+        # Materialise one block of cells as a long (Grid_id, date) frame, over all dates or a slice of them
+        dates = self.dates[days]
+        columns = {}
+        for column, (array, day_index) in self.features.items():
+            block = array[start:stop]
+            if block.ndim == 1:
+                # Static feature: broadcast along date without copying the source array
+                block = np.broadcast_to(block[:, None], (len(block), len(dates)))
+            elif day_index is not None:
+                block = block[:, day_index[days]]
+            else:
+                block = block[:, days]
+            columns[column] = block
+        return DCPHelper.to_long(self.grid_ids[start:stop], dates, columns)
+
+    def chunk_bounds(self):
+        return [(start, min(start + self.chunk_cells, len(self.grid_ids)))
+                for start in range(0, len(self.grid_ids), self.chunk_cells)]
+
+    def to_frame(self):
+        self.compute()
+        return pd.concat([self.chunk(start, stop) for start, stop in self.chunk_bounds()], ignore_index=True)
+
+    def to_csv(self, path, workers=None):
+        self.compute()
+        workers = workers or os.cpu_count() or 1
+
+        # CSV formatting holds the GIL, so chunks are formatted in worker processes and written in order.
+        # At most one window of chunks is in flight to cap memory.
+        header = ",".join(["Grid_id", "date"] + list(self.features)) + "\n"
+        bounds = self.chunk_bounds()
+        with open(path, "w", newline="") as f, ProcessPoolExecutor(max_workers=workers) as pool:
+            f.write(header)
+            for i in range(0, len(bounds), workers):
+                frames = [self.chunk(*chunk) for chunk in bounds[i:i + workers]]
+                for text in pool.map(DCPDatacube.format_csv, frames):
+                    f.write(text)
+
+    def format_csv(frame):
+        return frame.to_csv(index=False, header=False)
+
+    def to_parquet(self, path, workers=None):
+        # Directory of Parquet files, one per month ({year}-{month}.parquet) with one row group per chunk
+        # of cells. Each file only holds its month and follows the cube's (Grid_id, date) order, so
+        # readers skip files on date filters and row groups on Grid_id filters from the footer statistics.
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self.compute()
+        workers = workers or os.cpu_count() or 1
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path, exist_ok=True)
+
+        months = self.dates.to_period("M")
+        bounds = self.chunk_bounds()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for month in months.unique():
+                positions = np.flatnonzero(months == month)
+                days = slice(positions[0], positions[-1] + 1)
+
+                def render(chunk):
+                    return pa.Table.from_pandas(self.chunk(*chunk, days), preserve_index=False)
+
+                writer = None
+                for i in range(0, len(bounds), workers):
+                    for table in pool.map(render, bounds[i:i + workers]):
+                        if writer is None:
+                            writer = pq.ParquetWriter(f"{path}/{month}.parquet", table.schema)
+                        writer.write_table(table.cast(writer.schema), row_group_size=table.num_rows)
+                if writer is not None:
+                    writer.close()
@@ -0,0 +1,102 @@
+import os
+import json
+import shutil
+import numpy as np
+from DCPDatacube import DCPDatacube
+from DCPHelper import DCPHelper
+
+
+class DCPDatasetStore:
+    STATIC = "static"
+
+    def __init__(self, directory, year, grid_ids):
+        # Partitions of the final dataset: one (cells, days) .npy per (month, column), one (cells,) .npy per static column
+        self.directory = f"{directory}/Final_Dataset_{year}"
+        self.year = year
+        self.index_path = f"{self.directory}/index.json"
+        self.grid_ids = np.asarray(grid_ids)
+        self.index = self.read_index()
+
+        # Partitions computed on another grid cannot be reused
+        grid_path = f"{self.directory}/grid_ids.npy"
+        if not os.path.exists(grid_path) or not np.array_equal(np.load(grid_path), self.grid_ids):
+            shutil.rmtree(self.directory, ignore_errors=True)
+            os.makedirs(self.directory)
+            np.save(grid_path, self.grid_ids)
+            self.index = {"partitions": {}, "csv": None}
+
+    def read_index(self):
+        if not os.path.exists(self.index_path):
+            return {}
+        with open(self.index_path) as f:
+            return json.load(f)
+
+    def write_index(self):
+        tmp_path = f"{self.index_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.index, f)
+        os.replace(tmp_path, self.index_path)
+
+    def columns(self, partition):
+        return self.index["partitions"].get(partition, [])
+
+    def has(self, partition, column):
+        return column in self.columns(partition)
+
+    def missing(self, months, features, static_features):
+        # month -> features with a column not stored yet; features map to the list of columns they write
+        missing = {}
+        for month in months:
+            needed = [feature for feature, columns in features.items()
+                      if not all(self.has(self.STATIC if feature in static_features else month, column)
+                                 for column in columns)]
+            if needed:
+                missing[month] = needed
+        return missing
+
+    def save(self, cube, months):
+        # Store the computed cube per month, leaving partitions that already exist untouched
+        month_of_date = np.array([f"{date.month:02}" for date in cube.dates])
+        for column, (array, day_index) in cube.compute().features.items():
+            if array.ndim == 1:
+                self.save_partition(self.STATIC, column, array)
+                continue
+            for month in months:
+                days = np.flatnonzero(month_of_date == month)
+                steps = days if day_index is None else day_index[days]
+                self.save_partition(month, column, array[:, steps])
+        self.write_index()
+
+    def save_partition(self, partition, column, array):
+        if self.has(partition, column):
+            return
+        os.makedirs(f"{self.directory}/{partition}", exist_ok=True)
+        np.save(f"{self.directory}/{partition}/{column}.npy", np.ascontiguousarray(array))
+        self.index["partitions"].setdefault(partition, []).append(column)
+
+    def load_cube(self, months, columns):
+        # Cube over the given months, reading every partition through a memory map
+        dates = DCPHelper.month_dates(self.year, months)
+        cube = DCPDatacube(self.grid_ids, dates)
+        for column in columns:
+            if self.has(self.STATIC, column):
+                cube.add_feature(column, self.grid_ids, np.load(f"{self.directory}/{self.STATIC}/{column}.npy", mmap_mode="r"))
+            else:
+                parts = [np.load(f"{self.directory}/{month}/{column}.npy", mmap_mode="r") for month in months]
+                cube.add_feature(column, self.grid_ids, parts[0] if len(parts) == 1 else np.concatenate(parts, axis=1))
+        return cube
+
+    def stored_columns(self, months, features):
+        # Columns of the selected features stored for every month, in feature order
+        stored = set.intersection(*[set(self.columns(month)) for month in months]) | set(self.columns(self.STATIC))
+        columns = []
+        for feature_columns in features.values():
+            columns += [column for column in feature_columns if column in stored and column not in columns]
+        return columns
+
+    def csv_state(self):
+        return self.index.get("csv")
+
+    def set_csv_state(self, months, columns):
+        self.index["csv"] = {"months": sorted(months), "columns": columns}
+        self.write_index()
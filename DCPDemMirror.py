@@ -0,0 +1,149 @@
+import os
+import math
+import threading
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import rasterio
+from rasterio.crs import CRS
+from rasterio.enums import Resampling
+from rasterio.transform import from_bounds
+from rasterio.windows import Window, from_bounds as window_from_bounds
+from DCPConstants import DCPConstants
+from DCPProfiler import DCPProfiler
+
+
+class DCPDemMirror:
+    NODATA = -32767
+
+    def __init__(self, directory, workers=DCPConstants.DEM_MIRROR_WORKERS, block_rows=DCPConstants.DEM_MIRROR_BLOCK_ROWS,
+                 profiler=None):
+        # Local copy of the Copernicus GLO-30 COG tiles, one 1x1 degree tile per file
+        self.directory = directory
+        self.workers = workers
+        self.block_rows = block_rows
+        self.profiler = profiler or DCPProfiler(enabled=False)
+
+    def tile_name(self, lat, lon):
+        # Tiles are named after their south-west corner
+        return (f"Copernicus_DSM_COG_10_{'N' if lat >= 0 else 'S'}{abs(lat):02}_00_"
+                f"{'E' if lon >= 0 else 'W'}{abs(lon):03}_00_DEM")
+
+    def tiles(self, bbox):
+        # Mirror files covering [West, South, East, North]; tiles over open water do not exist in GLO-30
+        west, south, east, north = bbox
+        paths = []
+        for lat in range(math.floor(south), math.ceil(north)):
+            for lon in range(math.floor(west), math.ceil(east)):
+                name = self.tile_name(lat, lon)
+                for path in (f"{self.directory}/{name}/{name}.tif", f"{self.directory}/{name}.tif"):
+                    if os.path.exists(path):
+                        paths.append(path)
+                        break
+        return paths
+
+    def overview_level(self, res, overviews, target_res):
+        # Coarsest COG overview that is still at least as fine as the target pixel size, None for the
+        # full resolution. overviews are the decimation factors of the tile, e.g. [2, 4, 8, 16].
+        ratio = min(target_res[0] / res[0], target_res[1] / res[1]) * (1 + 1e-9)
+        levels = [level for level, factor in enumerate(overviews) if factor <= ratio]
+        return levels[-1] if levels else None
+
+    def tile_header(self, path, target_res):
+        # Only the COG header is read; size and pixel size are those of the overview level to read
+        with rasterio.open(path) as src:
+            level = self.overview_level(src.res, src.overviews(1), target_res)
+        if level is None:
+            with rasterio.open(path) as src:
+                return path, None, src.bounds, src.res, src.width, src.height
+        with rasterio.open(path, overview_level=level) as src:
+            return path, level, src.bounds, src.res, src.width, src.height
+
+    def build_vrt(self, tiles, vrt_path, target_res):
+        # Mosaic of the tiles at the finest resolution read. Every tile is read from the overview level
+        # matching target_res (degrees per pixel), so coarse products never touch the full-resolution
+        # data. Northern tiles have fewer columns and are stretched into place by their destination rectangle.
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            headers = list(pool.map(lambda path: self.tile_header(path, target_res), tiles))
+        left = min(bounds.left for _, _, bounds, _, _, _ in headers)
+        right = max(bounds.right for _, _, bounds, _, _, _ in headers)
+        bottom = min(bounds.bottom for _, _, bounds, _, _, _ in headers)
+        top = max(bounds.top for _, _, bounds, _, _, _ in headers)
+        res_x = min(res[0] for _, _, _, res, _, _ in headers)
+        res_y = min(res[1] for _, _, _, res, _, _ in headers)
+
+        dataset = ET.Element("VRTDataset", rasterXSize=str(round((right - left) / res_x)),
+                             rasterYSize=str(round((top - bottom) / res_y)))
+        ET.SubElement(dataset, "SRS").text = CRS.from_epsg(4326).to_wkt()
+        ET.SubElement(dataset, "GeoTransform").text = f"{left!r}, {res_x!r}, 0, {top!r}, 0, {-res_y!r}"
+        band = ET.SubElement(dataset, "VRTRasterBand", dataType="Float32", band="1")
+        ET.SubElement(band, "NoDataValue").text = str(self.NODATA)
+        for path, level, bounds, _, width, height in headers:
+            source = ET.SubElement(band, "SimpleSource")
+            ET.SubElement(source, "SourceFilename", relativeToVRT="0").text = os.path.abspath(path)
+            if level is not None:
+                options = ET.SubElement(source, "OpenOptions")
+                ET.SubElement(options, "OOI", key="OVERVIEW_LEVEL").text = str(level)
+            ET.SubElement(source, "SourceBand").text = "1"
+            ET.SubElement(source, "SrcRect", xOff="0", yOff="0", xSize=str(width), ySize=str(height))
+            ET.SubElement(source, "DstRect",
+                          xOff=repr((bounds.left - left) / res_x), yOff=repr((top - bounds.top) / res_y),
+                          xSize=repr((bounds.right - bounds.left) / res_x), ySize=repr((bounds.top - bounds.bottom) / res_y))
+        ET.ElementTree(dataset).write(vrt_path)
+        return vrt_path
+
+    def read_blocks(self, vrt_path, bbox, shape):
+        # (first row, block) of the (rows, cols) elevation over bbox, in order. Horizontal blocks are read
+        # on a thread pool, at most one block per worker is held in memory.
+        west, south, east, north = bbox
+        height, width = shape
+        local = threading.local()
+        opened = []
+        with rasterio.open(vrt_path) as vrt:
+            window = window_from_bounds(west, south, east, north, transform=vrt.transform)
+
+        def read_block(start):
+            # Rasterio datasets are not shared between threads
+            if not hasattr(local, "vrt"):
+                local.vrt = rasterio.open(vrt_path)
+                opened.append(local.vrt)
+            stop = min(start + self.block_rows, height)
+            rows = window.height / height
+            block = Window(window.col_off, window.row_off + start * rows, window.width, (stop - start) * rows)
+            return local.vrt.read(1, window=block, out_shape=(stop - start, width), boundless=True,
+                                  fill_value=self.NODATA, resampling=Resampling.bilinear)
+
+        starts = range(0, height, self.block_rows)
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                for i in range(0, len(starts), self.workers):
+                    yield from zip(starts[i:i + self.workers], pool.map(read_block, starts[i:i + self.workers]))
+        finally:
+            for dataset in opened:
+                dataset.close()
+
+    def write_province(self, province, image_file, resolution=None):
+        # Same product as the remote DEM request: EPSG:4326 GeoTIFF over the provincial box, elevation in km,
+        # sea level where the mirror has no tile. The pixel size is not capped, so blocks are written to the
+        # GeoTIFF as they are read instead of being assembled in memory.
+        north, west, south, east = DCPConstants.PROVINCE_DICT[province]
+        bbox = (west, south, east, north)
+        resolution = resolution or DCPConstants.DEM_MIRROR_RESOLUTION or DCPConstants.RESOLUTION
+        width = int((east - west) * 111_320 / resolution)
+        height = int((north - south) * 110_574 / resolution)
+
+        tiles = self.tiles(bbox)
+        if not tiles:
+            raise FileNotFoundError(f"No Copernicus DEM tiles for {province} in {self.directory}")
+
+        with self.profiler.stage("dem_mirror") as stage:
+            target_res = ((east - west) / width, (north - south) / height)
+            vrt_path = self.build_vrt(tiles, f"{os.path.dirname(image_file) or '.'}/dem_mirror.vrt", target_res)
+            with rasterio.open(image_file, "w", driver="GTiff", height=height, width=width, count=1, dtype="float32",
+                               crs=CRS.from_epsg(4326), transform=from_bounds(west, south, east, north, width, height),
+                               tiled=True, BIGTIFF="IF_SAFER") as dst:
+                for start, block in self.read_blocks(vrt_path, bbox, (height, width)):
+                    dem = np.where(block == self.NODATA, 0, block / 1000).astype(np.float32)
+                    dst.write(dem, 1, window=Window(0, start, width, len(dem)))
+                    stage.add_rows(dem.size)
+        return image_file
@@ -2,14 +2,17 @@ import pandas as pd
 import numpy as np
 import geopandas as gpd
 from DCPConstants import DCPConstants
+from DCPProfiler import DCPProfiler
+from DCPGridLocator import DCPGridLocator
 
 
 class DCPFire:
-    def __init__(self, province, year, months):
+    def __init__(self, province, year, months, profiler=None):
         self.province_code=DCPConstants.PROVINCE_CODES[province]
         self.year=int(year)
         self.months=[int(DCPConstants.MONTHS_DICT[month]) for month in months]
         self.directory = province.replace(" ", "_")
+        self.profiler = profiler or DCPProfiler(self.directory, enabled=False)
 
     def generate_provincial_shp(self, filename):
         ca_fire_gdf=gpd.read_file(filename)
@@ -18,31 +21,61 @@ class DCPFire:
         data.to_file(f'{self.directory}/FireData.shp')
 
     def generate_dataset(self):
-        grid_layer = gpd.read_file(f'{self.directory}/clippedGrid.shp')
-        fire_gdf = gpd.read_file(f'{self.directory}/FireData.shp')
-
-        # Ensure both layers have the same CRS
-        if grid_layer.crs != fire_gdf.crs:
-            fire_gdf = fire_gdf.to_crs(grid_layer.crs)
+        with self.profiler.stage("fire_join") as stage:
+            joined = self._generate_dataset()
+            stage.add_rows(len(joined))
+        return joined
 
-        # Join attributes by location
-        joined = gpd.sjoin(grid_layer, fire_gdf, how="left", predicate="intersects")
+    def register(self, cube):
+        cube.add_source(lambda: self.generate_arrays(cube.grid_ids, cube.dates))
 
-        # Create 'date' column conditionally
-        joined['REP_DATE'] = pd.to_datetime(joined['REP_DATE'], errors='coerce')
-        joined['date'] = pd.to_datetime(joined[['YEAR', 'MONTH', 'DAY']], errors='coerce')
+    def generate_arrays(self, grid_ids, dates):
+        # Dense (cells, days) ignition flags on the cube coordinates
+        fire_df = self.generate_dataset()
+        ignition = np.zeros((len(grid_ids), len(dates)), dtype=np.uint8)
+        rows = pd.Index(grid_ids).get_indexer(fire_df['Grid_id'])
+        cols = pd.DatetimeIndex(dates).get_indexer(fire_df['date'].dt.normalize())
+        found = (rows >= 0) & (cols >= 0)
+        ignition[rows[found], cols[found]] = 1
+        return grid_ids, {'ignition': ignition}
 
-        # If YEAR, MONTH, or DAY is null, use REP_DATE for 'date'
-        joined['date'] = joined['date'].fillna(joined['REP_DATE'])
+    def _generate_dataset(self):
+        joined = self.fire_records()
 
         # Filter the DataFrame
-        joined = joined[(joined['date'].dt.month.isin(self.months)) & (joined['date'].dt.year == self.year)]
-
-        joined.drop(columns=[col for col in joined.columns if col not in ['id', 'date']], inplace=True)
-        joined.rename(columns={'id': 'Grid_id'}, inplace=True)
+        joined = joined[(joined['date'].dt.month.isin(self.months)) & (joined['date'].dt.year == self.year)].copy()
 
         # Fill the ignition columns with an non nan date with 1, and the rest with 0
         joined['ignition'] = np.where(joined['date'].notna(), 1, 0)
         joined.drop_duplicates(inplace=True)
 
         return joined
+
+    def fire_records(self):
+        # (Grid_id, date) of every dated fire record in the province, all years
+        locator = DCPGridLocator.load_or_build(self.directory)
+        fire_gdf = gpd.read_file(f'{self.directory}/FireData.shp')
+
+        # Ensure both layers have the same CRS
+        fire_gdf = fire_gdf.to_crs(locator.crs)
+
+        if (fire_gdf.geom_type == "Point").all():
+            # Point records: assign the cell arithmetically from the lattice
+            ids = locator.locate(fire_gdf.geometry.x, fire_gdf.geometry.y)
+            joined = pd.DataFrame(fire_gdf.drop(columns='geometry')).assign(id=ids)
+            joined = joined[joined['id'] >= 0]
+        else:
+            # Join attributes by location
+            grid_layer = gpd.read_file(f'{self.directory}/clippedGrid.shp')
+            joined = gpd.sjoin(grid_layer, fire_gdf, how="left", predicate="intersects")
+
+        joined['date'] = DCPFire.record_dates(joined)
+        joined = joined[joined['date'].notna()]
+        joined = joined.drop(columns=[col for col in joined.columns if col not in ['id', 'date']])
+        return joined.rename(columns={'id': 'Grid_id'})
+
+    @staticmethod
+    def record_dates(records):
+        # Date of every fire record from YEAR, MONTH and DAY; REP_DATE where one of them is null
+        dates = pd.to_datetime(records[['YEAR', 'MONTH', 'DAY']], errors='coerce')
+        return dates.fillna(pd.to_datetime(records['REP_DATE'], errors='coerce'))
@@ -0,0 +1,134 @@
+import os
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from shapely.geometry import box
+from DCPConstants import DCPConstants
+from DCPHelper import DCPHelper
+from DCPProfiler import DCPProfiler
+from DCPGridLocator import DCPGridLocator
+from DCPFire import DCPFire
+
+
+class DCPFireHistory:
+    YEARS = DCPConstants.FIRE_HISTORY_YEARS
+
+    # Feature -> output columns
+    FEATURES = {feature: DCPConstants.FEATURE_COLUMNS[feature]
+                for feature in ["Days Since Fire", "Fire History", "Neighbourhood Fire History"]}
+
+    def __init__(self, province, year, months, features, profiler=None, fire_file=None):
+        self.province=province
+        self.year=year
+        self.months=[DCPConstants.MONTHS_DICT[month] for month in months]
+        self.features=[feature for feature in self.FEATURES if feature in features]
+        self.directory = self.province.replace(" ", "_")
+        self.fire_file = fire_file  # National fire records; the provincial FireData.shp when not given
+        self.index_path = f"{self.directory}/fireIndex.npz"
+        self.profiler = profiler or DCPProfiler(self.directory, enabled=False)
+
+    def generate_dataset(self):
+        grid_ids = DCPGridLocator.load_or_build(self.directory).lookup
+        grid_ids, arrays = self.generate_arrays(np.sort(grid_ids[grid_ids >= 0]), self.generate_dates())
+        return DCPHelper.to_long(grid_ids, self.generate_dates(), arrays)
+
+    def register(self, cube):
+        cube.add_source(lambda: self.generate_arrays(cube.grid_ids, cube.dates))
+
+    def generate_dates(self):
+        return DCPHelper.month_dates(self.year, self.months)
+
+    def fire_index(self):
+        # Every fire day on the provincial lattice and one cell around it, built once and reused until the
+        # fire data or the grid change. Returns the Grid_id (-1 outside the grid), the cell of the lattice
+        # padded by one cell on every side, and the day of each record.
+        source = self.fire_file or f"{self.directory}/FireData.shp"
+        if os.path.exists(self.index_path):
+            with np.load(self.index_path) as data:
+                # Indexes from before the padded lattice have no source and are rebuilt
+                built_from = str(data["source"]) if "source" in data.files else None
+                index = (data["grid_ids"], data["cells"], data["days"]) if built_from else None
+            sources = [built_from, f"{self.directory}/gridLocator.npz"]
+            if (built_from and (not self.fire_file or self.fire_file == built_from) and
+                    all(os.path.getmtime(self.index_path) >= os.path.getmtime(path)
+                        for path in sources if os.path.exists(path))):
+                return index
+
+        # National records keep fires just across the provincial boundary and fires reported by other
+        # agencies; only those within one cell of the lattice are read
+        locator = DCPGridLocator.load_or_build(self.directory)
+        n_rows, n_cols = locator.lookup.shape
+        (x0, y0), (step_x, step_y) = locator.origin, locator.step
+        extent = box(x0 - step_x, y0 - step_y, x0 + (n_cols + 1) * step_x, y0 + (n_rows + 1) * step_y)
+        fires = gpd.read_file(source, bbox=gpd.GeoSeries([extent], crs=locator.crs))
+        dates = DCPFire.record_dates(fires)
+        fires, dates = fires[dates.notna().to_numpy()], dates[dates.notna()]
+
+        # Records with an area are placed at a point inside them
+        points = fires.geometry.to_crs(locator.crs)
+        if not (points.geom_type == "Point").all():
+            points = points.representative_point()
+        x, y = points.x.to_numpy(), points.y.to_numpy()
+        col = np.floor((x - x0) / step_x).astype(np.int64)
+        row = np.floor((y - y0) / step_y).astype(np.int64)
+        near = (col >= -1) & (col <= n_cols) & (row >= -1) & (row <= n_rows)
+
+        grid_ids = locator.locate(x[near], y[near])
+        cells = (col[near] + 1) * (n_rows + 2) + row[near] + 1
+        days = dates.dt.normalize().to_numpy()[near].astype("datetime64[D]").astype(np.int64)
+        index = np.unique(np.stack([grid_ids, cells, days], axis=1), axis=0)
+        np.savez(self.index_path, grid_ids=index[:, 0], cells=index[:, 1], days=index[:, 2],
+                 source=np.asarray(source))
+        return index[:, 0], index[:, 1], index[:, 2]
+
+    def generate_arrays(self, grid_ids, dates):
+        with self.profiler.stage("fire_history") as stage:
+            fire_ids, fire_lattice, fire_days = self.fire_index()
+
+            # Fires of the grid's cells become one sorted key per (cell, day), so every cell-day query
+            # below is a searchsorted on the same array
+            grid_ids = np.asarray(grid_ids)
+            fire_cells = pd.Index(grid_ids).get_indexer(fire_ids)
+            found = fire_cells >= 0
+            # Days are offset so records before 1970 keep a positive day within their cell's key range
+            span, offset = np.int64(1) << 32, np.int64(1) << 31
+            keys = np.sort(np.unique(fire_cells[found].astype(np.int64) * span + fire_days[found] + offset))
+            lattice_keys = np.sort(np.unique(fire_lattice * span + fire_days + offset))
+
+            days = pd.DatetimeIndex(dates).to_numpy().astype("datetime64[D]").astype(np.int64) + offset
+            queries = np.arange(len(grid_ids), dtype=np.int64)[:, None] * span + days[None, :]
+            before = np.searchsorted(keys, queries)  # Fires strictly before each cell-day
+
+            arrays = {}
+            if "Days Since Fire" in self.features:
+                last = keys[np.maximum(before - 1, 0)] if len(keys) else np.zeros_like(queries)
+                has_fire = (before > 0) & (last // span == queries // span)
+                arrays["DaysSinceFire"] = np.where(has_fire, queries - last, np.nan).astype(np.float32)
+
+            for years in self.YEARS:
+                # Fires in the trailing window [day - years, day)
+                window = round(365.25 * years)
+                if "Fire History" in self.features:
+                    arrays[f"Fires_{years}y"] = (before - np.searchsorted(keys, queries - window)).astype(np.float32)
+                if "Neighbourhood Fire History" in self.features:
+                    arrays[f"NbrFires_{years}y"] = self.neighbourhood_sum(grid_ids, days, lattice_keys, span, window)
+
+            stage.add_cells(len(grid_ids))
+            stage.add_rows(len(keys))
+        return grid_ids, arrays
+
+    def neighbourhood_sum(self, grid_ids, days, lattice_keys, span, window):
+        # Fires in the trailing window over the 8 lattice squares around every cell. Squares are counted
+        # whole, so fires outside the province or its grid count too.
+        n_rows = DCPGridLocator.load_or_build(self.directory).lookup.shape[0]
+        col, row = np.divmod(grid_ids.astype(np.int64), n_rows)
+        total = np.zeros((len(grid_ids), len(days)), dtype=np.float32)
+        for d_row in (-1, 0, 1):
+            for d_col in (-1, 0, 1):
+                if d_row == d_col == 0:
+                    continue
+                # Cell of the padded lattice used by the fire index
+                neighbour = (col + d_col + 1) * (n_rows + 2) + row + d_row + 1
+                queries = neighbour[:, None] * span + days[None, :]
+                total += np.searchsorted(lattice_keys, queries) - np.searchsorted(lattice_keys, queries - window)
+        return total
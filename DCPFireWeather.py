@@ -0,0 +1,208 @@
+from datetime import timedelta
+import numpy as np
+import pandas as pd
+from DCPConstants import DCPConstants
+from DCPHelper import DCPHelper
+from DCPProfiler import DCPProfiler
+from DCPCopernicus import DCPCopernicus
+from DCPNdvi import DCPNdvi
+
+
+class DCPFireWeather:
+    WINDOWS = DCPConstants.FIRE_WEATHER_WINDOWS
+    LAGS = DCPConstants.FIRE_WEATHER_LAGS
+
+    # Feature -> (output columns, ERA5 features it is computed from)
+    FEATURES = {
+        "Rolling Precipitation": (DCPConstants.FEATURE_COLUMNS["Rolling Precipitation"], ["Total Precipitation"]),
+        "Temperature Anomaly": (DCPConstants.FEATURE_COLUMNS["Temperature Anomaly"], ["Temperature"]),
+        "Fire Weather Index": (DCPConstants.FEATURE_COLUMNS["Fire Weather Index"],
+                               ["Temperature", "Total Precipitation", "Relative Humidity", "Average Wind Speed"]),
+        "Lagged NDVI": (DCPConstants.FEATURE_COLUMNS["Lagged NDVI"], []),
+    }
+
+    # Day length adjustment of the Duff Moisture Code and Drought Code by month (Van Wagner, 1987)
+    DMC_DAY_LENGTH = np.array([6.5, 7.5, 9.0, 12.8, 13.9, 13.9, 12.4, 10.9, 9.4, 8.0, 7.0, 6.0])
+    DC_DAY_LENGTH = np.array([-1.6, -1.6, -1.6, 0.9, 3.8, 5.8, 6.4, 5.0, 2.4, 0.4, -1.6, -1.6])
+
+    def __init__(self, province, year, months, features, profiler=None, spin_up=DCPConstants.FIRE_WEATHER_SPIN_UP):
+        self.province=province
+        self.year=int(year)
+        self.months=[DCPConstants.MONTHS_DICT[month] for month in months]
+        self.features=[feature for feature in self.FEATURES if feature in features]
+        self.spin_up=spin_up  # Days computed before the first selected date and dropped from the output
+        self.directory = self.province.replace(" ", "_")
+        self.profiler = profiler or DCPProfiler(self.directory, enabled=False)
+
+    def generate_dataset(self):
+        grid_ids, arrays = self.generate_arrays()
+        return DCPHelper.to_long(grid_ids, self.generate_dates(), arrays)
+
+    def register(self, cube):
+        cube.add_source(self.generate_arrays)
+
+    def generate_dates(self):
+        return DCPHelper.month_dates(self.year, self.months)
+
+    def history_months(self):
+        # Every (year, month) from the spin-up start to the last selected month, gaps included,
+        # so windows and recursive codes always run over consecutive days
+        dates = self.generate_dates()
+        start = pd.Timestamp(dates[0] - timedelta(days=self.spin_up)).to_period("M")
+        return list(pd.period_range(start, pd.Timestamp(dates[-1]).to_period("M"), freq="M"))
+
+    def generate_arrays(self):
+        periods = self.history_months()
+        history = pd.DatetimeIndex([date for period in periods
+                                    for date in DCPHelper.month_dates(period.year, [period.month])])
+        selected = history.get_indexer(pd.DatetimeIndex(self.generate_dates()))
+
+        grid_ids, inputs = self.read_inputs(periods)
+        arrays = {}
+        with self.profiler.stage("fire_weather") as stage:
+            if "Rolling Precipitation" in self.features:
+                # ERA5 is requested at 12:00 UTC only, so each day contributes the precipitation of that hour
+                # and the sums approximate the rainfall of the window rather than measure it
+                prcp = inputs["Prcp"] * 1000  # m -> mm
+                for window in self.WINDOWS:
+                    arrays[f"Prcp_{window}d"] = self.rolling_sum(prcp, window)
+            if "Temperature Anomaly" in self.features:
+                # Departure from the trailing mean of the longest window
+                arrays["T_anom"] = inputs["T"] - self.rolling_mean(inputs["T"], max(self.WINDOWS))
+            if "Fire Weather Index" in self.features:
+                arrays.update(self.fire_weather_index(inputs["T"] - 273.15, inputs["RelHum"], inputs["Ws"] * 3.6,
+                                                      inputs["Prcp"] * 1000, history.month.to_numpy()))
+            if "Lagged NDVI" in self.features:
+                for lag in self.LAGS:
+                    arrays[f"LagNDVI_{lag}d"] = self.lag(inputs["NDVI"], lag)
+
+            arrays = {column: np.ascontiguousarray(array[:, selected]) for column, array in arrays.items()}
+            stage.add_cells(len(grid_ids))
+            stage.add_rows(len(grid_ids) * len(selected) * len(arrays))
+        return grid_ids, arrays
+
+    def read_inputs(self, periods):
+        # (cells, history days) input arrays, one producer call per calendar year of the history
+        era5_features = sorted({name for feature in self.features for name in self.FEATURES[feature][1]})
+        years = sorted({period.year for period in periods})
+        month_names = {number: name for name, number in DCPConstants.MONTHS_DICT.items()}
+
+        grid_ids, inputs = None, {}
+        for year in years:
+            months = [month_names[f"{period.month:02}"] for period in periods if period.year == year]
+            parts = {}
+            if era5_features:
+                ids, arrays = DCPCopernicus(self.province, str(year), months, era5_features, self.profiler).generate_arrays()
+                grid_ids = ids if grid_ids is None else grid_ids
+                parts.update({column: self.align(grid_ids, ids, array) for column, array in arrays.items()})
+            if "Lagged NDVI" in self.features:
+                ids, arrays = DCPNdvi(self.province, year, months, self.profiler).generate_arrays()
+                grid_ids = ids if grid_ids is None else grid_ids
+                weekly, week_index = arrays["NDVI"]
+                parts["NDVI"] = self.align(grid_ids, ids, weekly[:, week_index])
+            for column, array in parts.items():
+                inputs.setdefault(column, []).append(array)
+        return grid_ids, {column: np.concatenate(arrays, axis=1) for column, arrays in inputs.items()}
+
+    def align(self, grid_ids, ids, array):
+        if np.array_equal(grid_ids, ids):
+            return np.asarray(array, dtype=np.float64)
+        return pd.DataFrame(array, index=ids).reindex(grid_ids).to_numpy(dtype=np.float64)
+
+    def rolling_sum(self, array, window):
+        # Trailing window sum from one cumulative sum along the day axis; NaN until the window is full
+        # or when a day in it is missing
+        valid = np.concatenate([np.zeros((len(array), 1)), np.cumsum(~np.isnan(array), axis=1)], axis=1)
+        total = np.concatenate([np.zeros((len(array), 1)), np.cumsum(np.nan_to_num(array), axis=1)], axis=1)
+        out = np.full(array.shape, np.nan)
+        out[:, window - 1:] = total[:, window:] - total[:, :-window]
+        out[:, window - 1:][valid[:, window:] - valid[:, :-window] < window] = np.nan
+        return out
+
+    def rolling_mean(self, array, window):
+        return self.rolling_sum(array, window) / window
+
+    def lag(self, array, days):
+        # Value from days earlier, NaN for the first days; a lag of 0 returns the values unchanged
+        out = np.full(array.shape, np.nan)
+        out[:, days:] = array[:, :max(array.shape[1] - days, 0)]
+        return out
+
+    def fire_weather_index(self, temp, rh, wind, rain, months):
+        # Canadian FWI System (Van Wagner, 1987). The moisture codes are recursive in time, so the
+        # days are walked in order with every cell updated at once; codes start from the standard
+        # spring values and settle during the spin-up days. A day with a missing input keeps the previous
+        # day's moisture codes, so one gap does not turn every later day into NaN.
+        # The system expects local noon observations and 24 hour rain. ERA5 is sampled at 12:00 UTC, early
+        # morning across Canada (local noon is around 17:00-20:00 UTC), and rain is the accumulation of that
+        # hour, so the codes approximate the standard ones: mornings are cooler and more humid than noon.
+        rh = np.clip(rh, 0, 100)
+        wind = np.maximum(wind, 0)
+        n_cells, n_days = temp.shape
+        codes = {column: np.empty((n_cells, n_days)) for column in self.FEATURES["Fire Weather Index"][0]}
+        ffmc, dmc, dc = np.full(n_cells, 85.0), np.full(n_cells, 6.0), np.full(n_cells, 15.0)
+
+        with np.errstate(invalid="ignore", divide="ignore", over="ignore"):
+            for day in range(n_days):
+                t, h, w, r, month = temp[:, day], rh[:, day], wind[:, day], rain[:, day], months[day] - 1
+                ffmc = self.carry(self.fine_fuel_moisture_code(ffmc, t, h, w, r), ffmc, t, h, w, r)
+                dmc = self.carry(self.duff_moisture_code(dmc, t, h, r, self.DMC_DAY_LENGTH[month]), dmc, t, h, r)
+                dc = self.carry(self.drought_code(dc, t, r, self.DC_DAY_LENGTH[month]), dc, t, r)
+                isi = self.initial_spread_index(ffmc, w)
+                bui = self.buildup_index(dmc, dc)
+                for column, values in zip(codes, (ffmc, dmc, dc, isi, bui, self.fire_weather(isi, bui))):
+                    codes[column][:, day] = values
+        return codes
+
+    def carry(self, code, previous, *inputs):
+        # Previous code wherever one of the inputs is missing; NaN does not always reach the result
+        missing = np.isnan(code)
+        for values in inputs:
+            missing |= np.isnan(values)
+        return np.where(missing, previous, code)
+
+    def fine_fuel_moisture_code(self, ffmc, t, h, w, r):
+        mo = 147.2 * (101 - ffmc) / (59.5 + ffmc)
+        rf = r - 0.5
+        wetting = 42.5 * rf * np.exp(-100 / (251 - mo)) * (1 - np.exp(-6.93 / rf))
+        wetting = np.where(mo > 150, wetting + 0.0015 * (mo - 150) ** 2 * np.sqrt(np.maximum(rf, 0)), wetting)
+        mo = np.where(r > 0.5, np.minimum(mo + wetting, 250), mo)
+
+        ed = 0.942 * h ** 0.679 + 11 * np.exp((h - 100) / 10) + 0.18 * (21.1 - t) * (1 - np.exp(-0.115 * h))
+        ew = 0.618 * h ** 0.753 + 10 * np.exp((h - 100) / 10) + 0.18 * (21.1 - t) * (1 - np.exp(-0.115 * h))
+        kd = (0.424 * (1 - (h / 100) ** 1.7) + 0.0694 * np.sqrt(w) * (1 - (h / 100) ** 8)) * 0.581 * np.exp(0.0365 * t)
+        kw = (0.424 * (1 - ((100 - h) / 100) ** 1.7) + 0.0694 * np.sqrt(w) * (1 - ((100 - h) / 100) ** 8)) \
+            * 0.581 * np.exp(0.0365 * t)
+        m = np.where(mo > ed, ed + (mo - ed) * 10 ** -kd, np.where(mo < ew, ew - (ew - mo) * 10 ** -kw, mo))
+        return np.clip(59.5 * (250 - m) / (147.2 + m), 0, 101)
+
+    def duff_moisture_code(self, dmc, t, h, r, day_length):
+        rk = 1.894 * (np.maximum(t, -1.1) + 1.1) * (100 - h) * day_length * 1e-4
+        rw = 0.92 * r - 1.27
+        wmi = 20 + np.exp(5.6348 - dmc / 43.43)
+        b = np.where(dmc <= 33, 100 / (0.5 + 0.3 * dmc),
+                     np.where(dmc <= 65, 14 - 1.3 * np.log(dmc), 6.2 * np.log(dmc) - 17.2))
+        wmr = wmi + 1000 * rw / (48.77 + b * rw)
+        pr = np.where(r > 1.5, np.maximum(244.72 - 43.43 * np.log(wmr - 20), 0), dmc)
+        return np.maximum(pr + rk, 0)
+
+    def drought_code(self, dc, t, r, day_length):
+        pe = np.maximum((0.36 * (np.maximum(t, -2.8) + 2.8) + day_length) / 2, 0)
+        rw = 0.83 * r - 1.27
+        smi = 800 * np.exp(-dc / 400)
+        dr = np.where(r > 2.8, np.maximum(dc - 400 * np.log(1 + 3.937 * rw / smi), 0), dc)
+        return dr + pe
+
+    def initial_spread_index(self, ffmc, w):
+        fm = 147.2 * (101 - ffmc) / (59.5 + ffmc)
+        return 19.115 * np.exp(-0.1386 * fm) * (1 + fm ** 5.31 / 4.93e7) * np.exp(0.05039 * w)
+
+    def buildup_index(self, dmc, dc):
+        bui = np.where(dmc <= 0.4 * dc, 0.8 * dc * dmc / (dmc + 0.4 * dc),
+                       dmc - (1 - 0.8 * dc / (dmc + 0.4 * dc)) * (0.92 + (0.0114 * dmc) ** 1.7))
+        return np.where((dmc == 0) & (dc == 0), 0, np.maximum(bui, 0))
+
+    def fire_weather(self, isi, bui):
+        bb = np.where(bui <= 80, 0.1 * isi * (0.626 * bui ** 0.809 + 2),
+                      0.1 * isi * (1000 / (25 + 108.64 * np.exp(-0.023 * bui))))
+        return np.where(bb <= 1, bb, np.exp(2.72 * (0.434 * np.log(bb)) ** 0.647))
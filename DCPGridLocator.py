@@ -0,0 +1,96 @@
+import os
+import math
+import numpy as np
+import geopandas as gpd
+import shapely
+from DCPConstants import DCPConstants
+
+
+class DCPGridLocator:
+    def __init__(self, origin, step, lookup, boundary, crs, directory=None):
+        # lookup[row, col] is the Grid_id of the lattice cell, -1 where the cell was clipped away;
+        # boundary[row, col] marks clipped cells that need an exact polygon test
+        self.origin = origin
+        self.step = step
+        self.lookup = lookup
+        self.boundary = boundary
+        self.crs = crs
+        self.directory = directory
+        self.geometries = None
+
+    @classmethod
+    def build(cls, grid, origin, step, n_cols, n_rows, directory=None):
+        # Grid ids follow the lattice order used by DCPShpGenerator: id = col * n_rows + row
+        ids = grid["id"].to_numpy().astype(np.int64)
+        col, row = np.divmod(ids, n_rows)
+        lookup = np.full((n_rows, n_cols), -1, dtype=np.int64)
+        lookup[row, col] = ids
+
+        boundary = np.zeros((n_rows, n_cols), dtype=bool)
+        boundary[row, col] = grid.geometry.area.to_numpy() < step[0] * step[1] * (1 - 1e-9)
+        return cls(origin, step, lookup, boundary, grid.crs.to_wkt(), directory)
+
+    @classmethod
+    def load_or_build(cls, directory):
+        # The saved locator is only reused while it is newer than the grid it indexes
+        path = f"{directory}/gridLocator.npz"
+        if os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(f"{directory}/clippedGrid.shp"):
+            return cls.load(path, directory)
+        return cls.rebuild(directory)
+
+    @classmethod
+    def rebuild(cls, directory):
+        # Lattice of the grid in directory, recomputed from the provincial bounds and saved
+        province = gpd.read_file(f"{directory}/Province.shp")
+        minx, miny, maxx, maxy = province.total_bounds
+        if DCPConstants.GRID_PYRAMID:
+            size, coarsest = min(DCPConstants.GRID_PYRAMID), max(DCPConstants.GRID_PYRAMID)
+            step = (size, size)
+            origin = (math.floor(minx / coarsest) * coarsest, math.floor(miny / coarsest) * coarsest)
+        else:
+            step = DCPConstants.GRID_SIZE
+            origin = (math.floor(minx), math.floor(miny))
+        n_cols = len(range(int(origin[0]), int(math.ceil(maxx)), int(step[0])))
+        n_rows = len(range(int(origin[1]), int(math.ceil(maxy)), int(step[1])))
+
+        locator = cls.build(gpd.read_file(f"{directory}/clippedGrid.shp"), origin, step, n_cols, n_rows, directory)
+        locator.save(f"{directory}/gridLocator.npz")
+        return locator
+
+    @classmethod
+    def load(cls, path, directory=None):
+        with np.load(path) as data:
+            return cls(tuple(data["origin"]), tuple(data["step"]), data["lookup"], data["boundary"],
+                       str(data["crs"]), directory)
+
+    def save(self, path):
+        np.savez(path, origin=np.asarray(self.origin, dtype=float), step=np.asarray(self.step, dtype=float),
+                 lookup=self.lookup, boundary=self.boundary, crs=np.asarray(self.crs))
+
+    def locate(self, x, y, exact=True):
+        # Grid_id of every (x, y) in the grid CRS, -1 outside the grid
+        x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+        col = np.floor((x - self.origin[0]) / self.step[0]).astype(np.int64)
+        row = np.floor((y - self.origin[1]) / self.step[1]).astype(np.int64)
+        n_rows, n_cols = self.lookup.shape
+        inside = (row >= 0) & (row < n_rows) & (col >= 0) & (col < n_cols)
+
+        ids = np.full(x.shape, -1, dtype=np.int64)
+        ids[inside] = self.lookup[row[inside], col[inside]]
+
+        # Only points in clipped boundary cells are tested against the cell polygon
+        if exact:
+            check = np.flatnonzero(inside)
+            check = check[self.boundary[row[check], col[check]]]
+            if len(check):
+                polygons = self.cell_geometries()[ids[check]]
+                ids[check[~shapely.intersects_xy(polygons, x[check], y[check])]] = -1
+        return ids
+
+    def cell_geometries(self):
+        # Grid_id -> clipped polygon, loaded on first use
+        if self.geometries is None:
+            grid = gpd.read_file(f"{self.directory}/clippedGrid.shp")
+            self.geometries = np.empty(int(self.lookup.max()) + 1, dtype=object)
+            self.geometries[grid["id"].to_numpy()] = grid.geometry.to_numpy()
+        return self.geometries
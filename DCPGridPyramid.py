@@ -0,0 +1,131 @@
+import os
+import math
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+from DCPDatacube import DCPDatacube
+
+
+class DCPGridPyramid:
+    # Aggregation of each feature to a coarser cell; anything not listed is an area-weighted mean
+    AGGREGATORS = {
+        "ignition": "max",
+        "DaysSinceFire": "min",
+        "NDVI_count": "sum",
+        "Wd": "circular",
+        "aspect": "circular",
+    }
+    SUM_PREFIXES = ("Fires_", "NbrFires_")  # Fire counts over trailing windows
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.mapping_path = f"{directory}/GridPyramid.csv"
+
+    def build(self, provincial_gdf, sizes):
+        # Nested square grids; every size must be a multiple of the finest one
+        sizes = sorted(int(size) for size in sizes)
+        finest = sizes[0]
+        if any(size % finest for size in sizes):
+            raise ValueError(f"Grid sizes {sizes} are not multiples of the finest size {finest}")
+
+        # Snap the origin to the coarsest step so every level shares the same lattice corners
+        minx, miny, maxx, maxy = provincial_gdf.total_bounds
+        coarsest = sizes[-1]
+        origin = (math.floor(minx / coarsest) * coarsest, math.floor(miny / coarsest) * coarsest)
+
+        grids = {}
+        for size in sizes:
+            grids[size] = self.clipped_lattice(provincial_gdf, origin, size, maxx, maxy)
+            grids[size].to_file(self.grid_path(size))
+
+        # finest id -> ancestor id at every level, from the lattice (col, row) by floor division
+        fine = grids[finest]
+        mapping = pd.DataFrame({"id": fine["id"].to_numpy(), "area": fine.geometry.area.to_numpy()})
+        n_rows_fine = self.lattice_rows(origin, finest, maxy)
+        col, row = np.divmod(mapping["id"].to_numpy(), n_rows_fine)
+        for size in sizes[1:]:
+            factor = size // finest
+            mapping[f"id_{size}"] = (col // factor) * self.lattice_rows(origin, size, maxy) + row // factor
+        mapping.to_csv(self.mapping_path, index=False)
+        return grids
+
+    def grid_path(self, size):
+        return f"{self.directory}/clippedGrid_{size}m.shp"
+
+    def lattice_rows(self, origin, size, maxy):
+        return int(math.ceil((maxy - origin[1]) / size))
+
+    def clipped_lattice(self, provincial_gdf, origin, size, maxx, maxy):
+        n_cols = int(math.ceil((maxx - origin[0]) / size))
+        n_rows = self.lattice_rows(origin, size, maxy)
+
+        # Same id order as the single grid: x outer, y inner
+        col, row = np.divmod(np.arange(n_cols * n_rows), n_rows)
+        x0 = origin[0] + col * size
+        y0 = origin[1] + row * size
+        lattice = gpd.GeoDataFrame({"id": np.arange(n_cols * n_rows)},
+                                   geometry=shapely.box(x0, y0, x0 + size, y0 + size),
+                                   crs=provincial_gdf.crs)
+        # Cells touching the province only at a corner or edge would clip to points or lines
+        clipped = gpd.clip(lattice, provincial_gdf, keep_geom_type=True)
+        return clipped[~clipped.geometry.is_empty].sort_values("id")
+
+    def load_mapping(self):
+        return pd.read_csv(self.mapping_path)
+
+    def has_levels(self, sizes):
+        # Whether the province grid was built as a pyramid with every coarser size in sizes
+        if not os.path.exists(self.mapping_path):
+            return False
+        columns = set(pd.read_csv(self.mapping_path, nrows=0).columns)
+        return all(f"id_{size}" in columns for size in sorted(sizes)[1:])
+
+    def aggregator(self, column):
+        if column.startswith(self.SUM_PREFIXES):
+            return "sum"
+        return self.AGGREGATORS.get(column, "mean")
+
+    def aggregate_cube(self, cube, size, mapping=None):
+        # Aggregate a finest-level cube to a coarser level with each feature's aggregator
+        mapping = self.load_mapping() if mapping is None else mapping
+        mapping = mapping.set_index("id").reindex(cube.grid_ids)
+        parents = mapping[f"id_{size}"].to_numpy()
+        areas = mapping["area"].fillna(0).to_numpy()
+
+        known = ~np.isnan(parents)
+        parent_ids, parent_rows = np.unique(parents[known].astype(np.int64), return_inverse=True)
+        order = np.flatnonzero(known)[np.argsort(parent_rows, kind="stable")]
+        starts = np.concatenate([[0], np.flatnonzero(np.diff(np.sort(parent_rows))) + 1])
+
+        coarse = DCPDatacube(parent_ids, cube.dates, cube.chunk_cells)
+        for column, (array, day_index) in cube.compute().features.items():
+            values = array[order].astype(np.float64)
+            weights = areas[order].reshape((-1,) + (1,) * (values.ndim - 1))
+            aggregator = self.aggregator(column)
+            if aggregator == "max":
+                reduced = np.fmax.reduceat(values, starts, axis=0)
+            elif aggregator == "min":
+                reduced = np.fmin.reduceat(values, starts, axis=0)
+            elif aggregator == "sum":
+                valid = ~np.isnan(values)
+                reduced = np.add.reduceat(np.where(valid, values, 0), starts, axis=0)
+                reduced[np.add.reduceat(valid, starts, axis=0) == 0] = np.nan
+            elif aggregator == "circular":
+                # Angles in degrees: area-weighted mean of the unit vectors
+                radians = np.radians(values)
+                sin = self.weighted_mean(np.sin(radians), weights, starts)
+                cos = self.weighted_mean(np.cos(radians), weights, starts)
+                reduced = np.degrees(np.arctan2(sin, cos)) % 360
+            else:
+                reduced = self.weighted_mean(values, weights, starts)
+            coarse.add_feature(column, parent_ids, reduced, day_index)
+        return coarse
+
+    def weighted_mean(self, values, weights, starts):
+        # Area-weighted mean per parent, renormalised over the children with data
+        valid = ~np.isnan(values)
+        sums = np.add.reduceat(np.where(valid, values * weights, 0), starts, axis=0)
+        norms = np.add.reduceat(valid * weights, starts, axis=0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return sums / norms
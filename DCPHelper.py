@@ -1,5 +1,7 @@
 import os
+import numpy as np
 import pandas as pd
+from datetime import datetime, timedelta
 
 class DCPHelper:
     def getFilenameNoPath(filename: str):
@@ -29,4 +31,24 @@ class DCPHelper:
 
         return merged_data
 
-
+    def month_dates(year, months):
+        # Every day of the selected months
+        dates = []
+        for month in months:
+            date = datetime(int(year), int(month), 1)
+            while date.month == int(month):
+                dates.append(date)
+                date += timedelta(days=1)
+        return dates
+
+    def to_long(grid_ids, dates, columns):
+        # Convert {column: (cells, days) array} into a long frame, one row per (Grid_id, date)
+        grid_ids = np.asarray(grid_ids)
+        dates = np.asarray(dates, dtype="datetime64[ns]")
+        out_df = pd.DataFrame({
+            "Grid_id": np.repeat(grid_ids, len(dates)),
+            "date": np.tile(dates, len(grid_ids)),
+        })
+        for column, values in columns.items():
+            out_df[column] = np.asarray(values).ravel()
+        return out_df
@@ -0,0 +1,36 @@
+import importlib
+import threading
+
+
+class DCPLazy:
+    # Stand-in for a module, or a class of the same name inside it, imported on first use
+    def __init__(self, module, attribute=None):
+        self._module = module
+        self._attribute = attribute
+        self._target = None
+
+    def resolve(self):
+        if self._target is None:
+            target = importlib.import_module(self._module)
+            if self._attribute:
+                target = getattr(target, self._attribute)
+            self._target = target
+        return self._target
+
+    def __getattr__(self, name):
+        return getattr(self.resolve(), name)
+
+    def __call__(self, *args, **kwargs):
+        return self.resolve()(*args, **kwargs)
+
+    def warm_up(*lazy_objects):
+        # Import in the background so the first stage does not wait on it; the import lock keeps this safe
+        def run():
+            for lazy in lazy_objects:
+                try:
+                    lazy.resolve()
+                except ImportError:
+                    pass  # Reported when the stage that needs it runs
+        thread = threading.Thread(target=run, name="DCPWarmUp", daemon=True)
+        thread.start()
+        return thread
@@ -1,18 +1,30 @@
 import sys
 import os
-import pandas as pd
+import importlib.util
+from PyQt5.QtCore import QTimer
 from PyQt5.QtWidgets import (
     QApplication, QWidget, QVBoxLayout, QHBoxLayout, QPushButton,
     QLineEdit, QLabel, QFileDialog, QMessageBox
 )
-from DCPHelper import DCPHelper
 from DCPConstants import DCPConstants
-from DCPShpGenerator import DCPShpGenerator
+from DCPLazy import DCPLazy
 from CheckableComboBox import CheckableComboBox
-from DCPFire import DCPFire
-from DCPCopernicus import DCPCopernicus
-from DCPTopographical import DCPTopographical
-from DCPNdvi import DCPNdvi
+
+# Heavy modules (geopandas, rasterio, cdsapi, sentinelhub, ...) are imported when a stage first uses them
+gpd = DCPLazy("geopandas")
+DCPHelper = DCPLazy("DCPHelper", "DCPHelper")
+DCPShpGenerator = DCPLazy("DCPShpGenerator", "DCPShpGenerator")
+DCPFire = DCPLazy("DCPFire", "DCPFire")
+DCPCopernicus = DCPLazy("DCPCopernicus", "DCPCopernicus")
+DCPTopographical = DCPLazy("DCPTopographical", "DCPTopographical")
+DCPNdvi = DCPLazy("DCPNdvi", "DCPNdvi")
+DCPFireWeather = DCPLazy("DCPFireWeather", "DCPFireWeather")
+DCPFireHistory = DCPLazy("DCPFireHistory", "DCPFireHistory")
+DCPProfiler = DCPLazy("DCPProfiler", "DCPProfiler")
+DCPDatacube = DCPLazy("DCPDatacube", "DCPDatacube")
+DCPGridPyramid = DCPLazy("DCPGridPyramid", "DCPGridPyramid")
+DCPDatasetStore = DCPLazy("DCPDatasetStore", "DCPDatasetStore")
+DCPMapView = DCPLazy("DCPMapView", "DCPMapView")
 
 class DCPMain(QWidget):
     def __init__(self):
@@ -108,6 +120,10 @@ class DCPMain(QWidget):
         self.dataset_button = QPushButton("Generate Dataset")
         self.dataset_button.clicked.connect(self.generate_dataset)
 
+        # Map Preview Button
+        self.map_button = QPushButton("Preview Map")
+        self.map_button.clicked.connect(self.preview_map)
+
 
 
         # Add widgets and layouts to main layout
@@ -119,10 +135,17 @@ class DCPMain(QWidget):
         layout.addLayout(month_layout)
         layout.addLayout(feature_layout)
         layout.addWidget(self.dataset_button)
+        layout.addWidget(self.map_button)
 
         # Set layout to window
         self.setLayout(layout)
 
+    def warm_up(self):
+        # Load the pipeline modules in the background once the window is up
+        if DCPConstants.WARM_UP_IMPORTS:
+            DCPLazy.warm_up(gpd, DCPHelper, DCPShpGenerator, DCPFire, DCPCopernicus, DCPTopographical, DCPNdvi,
+                            DCPFireWeather, DCPFireHistory, DCPProfiler, DCPDatacube, DCPGridPyramid, DCPDatasetStore)
+
     def select_file(self):
         file_path, _ = QFileDialog.getOpenFileName(self, "Choose File", "", "Shapefiles (*.shp)")
         if file_path:
@@ -151,6 +174,91 @@ class DCPMain(QWidget):
         QMessageBox.information(self, "Shapefile Generated",
                                 f"Shapefile generated for {self.province}")
 
+    def preview_map(self):
+        province = self.province_input.text().title()
+        if not province or province not in DCPConstants.PROVINCE_DICT:
+            QMessageBox.warning(self, "Province Missing", "Please enter a valid province.")
+            return
+        directory = province.replace(" ", "_")
+        if not os.path.exists(f"{directory}/clippedGrid.shp"):
+            QMessageBox.warning(self, "Provincial Datasets Missing", f"Please generate the provincial datasets for {province}.")
+            return
+        year = self.year_input.text()
+        if not year.isdigit() or int(year)<1940 or int(year)>2024:
+            QMessageBox.warning(self, "Year Missing", "Please enter a valid year between 1940 and 2024.")
+            return
+
+        # Kept on the window so the preview is not garbage collected
+        self.map_view=DCPMapView(province, year)
+        self.map_view.show()
+
+    def build_cube(self, grid_ids, months, features, profiler, fire=True):
+        # Every producer registers its features on a shared (Grid_id x date) cube;
+        # nothing is computed until the cube is exported
+        dates=DCPHelper.month_dates(self.year, [DCPConstants.MONTHS_DICT[month] for month in months])
+        cube=DCPDatacube(grid_ids, dates)
+
+        if set(DCPCopernicus.FEATURES) & set(features):
+            DCPCopernicus(self.province, self.year, months, features, profiler).register(cube)
+
+        if "NDVI" in features:
+            DCPNdvi(self.province, self.year, months, profiler).register(cube)
+
+        if set(DCPTopographical.COLUMNS) & set(features):
+            DCPTopographical(self.province, features, profiler).register(cube)
+
+        if set(DCPFireWeather.FEATURES) & set(features):
+            DCPFireWeather(self.province, self.year, months, features, profiler).register(cube)
+
+        if set(DCPFireHistory.FEATURES) & set(features):
+            DCPFireHistory(self.province, self.year, months, features, profiler,
+                           self.selected_firedata or None).register(cube)
+
+        if fire:
+            DCPFire(self.province, self.year, months, profiler).register(cube)
+        return cube
+
+    def feature_columns(self, features):
+        # Selected feature -> the columns it writes, ignition last
+        columns={feature: DCPConstants.FEATURE_COLUMNS.get(feature, [feature]) for feature in features}
+        if "NDVI" in columns and DCPConstants.NDVI_BACKEND != "statistics":
+            columns["NDVI"]=["NDVI"]
+        columns["Fire"]=DCPConstants.FEATURE_COLUMNS["Fire"]
+        return columns
+
+    def update_dataset(self, directory, grid_ids, output_path, profiler):
+        # Only (month, feature) partitions missing from the store are computed
+        store=DCPDatasetStore(directory, self.year, grid_ids)
+        month_names={number: name for name, number in DCPConstants.MONTHS_DICT.items()}
+        features=self.feature_columns(self.features)
+        previous=store.csv_state() if os.path.exists(output_path) else None
+
+        months=[DCPConstants.MONTHS_DICT[month] for month in self.months]
+        if previous:
+            months=sorted(set(months) | set(previous["months"]))
+
+        # Months missing the same features are computed together
+        groups={}
+        for month, missing in store.missing(months, features, set(DCPTopographical.COLUMNS)).items():
+            groups.setdefault(tuple(missing), []).append(month)
+        for missing, group in groups.items():
+            cube=self.build_cube(grid_ids, [month_names[month] for month in group], list(missing), profiler,
+                                 fire="Fire" in missing)
+            with profiler.stage("extract"):
+                cube.compute()
+            store.save(cube, group)
+
+        columns=store.stored_columns(months, features)
+        with profiler.stage("export") as stage:
+            # The CSV is rewritten from the stored partitions, which keeps it sorted by (Grid_id, date);
+            # appending months after the existing rows would not. It is left alone when nothing changed.
+            if previous != {"months": sorted(months), "columns": columns}:
+                store.load_cube(months, columns).to_csv(output_path)
+                store.set_csv_state(months, columns)
+            stage.add_cells(len(grid_ids))
+
+        return store.load_cube(months, columns)
+
     def generate_dataset(self):
         self.province = self.province_input.text().title()
         if not self.province or self.province not in DCPConstants.PROVINCE_DICT:
@@ -180,54 +288,64 @@ class DCPMain(QWidget):
             QMessageBox.warning(self, "Fire Dataset Missing", "Please choose the provincial fire dataset for Canada.")
             return
 
-        # Create instance of DCPFire, if fire data is selected, generate provincial fire data
-        fire=DCPFire(self.province, self.year, self.months)
+        # Coarser levels are aggregated after the extraction, so a grid made without them is caught up front
+        if len(DCPConstants.GRID_PYRAMID) > 1 and not DCPGridPyramid(directory).has_levels(DCPConstants.GRID_PYRAMID):
+            QMessageBox.warning(self, "Grid Pyramid Missing", f"The grid of {self.province} was generated without the "
+                                f"GRID_PYRAMID levels {DCPConstants.GRID_PYRAMID}. Please delete the {directory} "
+                                "folder and generate the provincial datasets again.")
+            return
+
+        profiler=DCPProfiler(directory, trace=DCPConstants.PROFILE_TRACE,
+                             cprofile_stages=DCPConstants.PROFILE_STAGES)
+
+        # Sorted ids keep the Parquet row groups ordered by Grid_id, so DCPQuery can skip them by range
+        grid_ids=gpd.read_file(f"{directory}/clippedGrid.shp", ignore_geometry=True)['id'].sort_values().to_numpy()
+        fire_data=DCPFire(self.province, self.year, self.months, profiler)
         if self.selected_firedata and not os.path.exists(f"{directory}/FireData.shp"):
-            fire.generate_provincial_shp(self.selected_firedata)
-        fire_df=fire.generate_dataset()
-
-        topo_df=pd.DataFrame()
-        all_df=[]
-        merged_df=pd.DataFrame()
-        if {"Temperature", "Total Precipitation", "Average Wind Speed", "Relative Humidity"} & set(self.features):
-            cop=DCPCopernicus(self.province, self.year, self.months, self.features)
-            cop_df=cop.generate_dataset()
-            all_df.append(cop_df)
-
-        if "NDVI" in self.features:
-            ndvi=DCPNdvi(self.province, self.year, self.months)
-            ndvi_df=ndvi.generate_dataset()
-            all_df.append(ndvi_df)
-
-        if {"Slope", "Aspect", "Elevation"} & set(self.features):
-            topo=DCPTopographical(self.province, self.features)
-            topo_df=topo.generate_dataset()
-
-        # If both cop and ndvi present, merge them
-        if all_df:
-            if len(all_df)==2:
-                merged_df=DCPHelper.merge('inner', all_df)
-            else:
-                merged_df=all_df[0]
+            with profiler.stage("fire_extract"):
+                fire_data.generate_provincial_shp(self.selected_firedata)
 
-        if not merged_df.empty and not topo_df.empty:
-            merged_data=DCPHelper.merge_grid_id('inner', merged_df, topo_df)
-            merged_data=DCPHelper.merge('left', merged_data, fire_df)
-        elif not topo_df.empty:
-            merged_data=DCPHelper.merge_grid_id('left', topo_df, fire_df)
+        output_path=f'{directory}/Final_Dataset_{self.year}.csv'
+        if DCPConstants.APPEND_MODE:
+            cube=self.update_dataset(directory, grid_ids, output_path, profiler)
         else:
-            merged_data=DCPHelper.merge('left', merged_df, fire_df)
-
-        # Fill ignition col with 0 for non-fire dates
-        merged_data['ignition'] = merged_data['ignition'].fillna(0)
-        merged_data.to_csv(f'{directory}/Final_Dataset_{self.year}.csv', index=False)
+            cube=self.build_cube(grid_ids, self.months, self.features, profiler)
+            # The producers run here, so the export stage only times the CSV itself
+            with profiler.stage("extract") as stage:
+                cube.compute()
+                stage.add_cells(len(cube.grid_ids))
+            with profiler.stage("export") as stage:
+                cube.to_csv(output_path)
+                stage.add_cells(len(cube.grid_ids))
+                stage.add_rows(len(cube.grid_ids) * len(cube.dates))
+
+        if DCPConstants.EXPORT_PARQUET:
+            if importlib.util.find_spec("pyarrow") is None:
+                QMessageBox.warning(self, "Parquet Export Skipped", "pyarrow is not installed, the Parquet dataset was not written.")
+            else:
+                with profiler.stage("export_parquet") as stage:
+                    cube.to_parquet(f'{directory}/Final_Dataset_{self.year}.parquet')
+                    stage.add_rows(len(cube.grid_ids) * len(cube.dates))
+
+        # Coarser grid levels are aggregated from the finest-level cube, no further extraction
+        if len(DCPConstants.GRID_PYRAMID) > 1:
+            pyramid=DCPGridPyramid(directory)
+            mapping=pyramid.load_mapping()
+            for size in sorted(DCPConstants.GRID_PYRAMID)[1:]:
+                with profiler.stage(f"pyramid_{size}m") as stage:
+                    coarse=pyramid.aggregate_cube(cube, size, mapping)
+                    coarse.to_csv(f'{directory}/Final_Dataset_{self.year}_{size}m.csv')
+                    stage.add_cells(len(coarse.grid_ids))
+        profiler.save()
 
         QMessageBox.information(self, "Dataset Generated",
                                 f"Copernicus dataset generated for {self.province}")
 
 
 # Main execution
-app = QApplication(sys.argv)
-window = DCPMain()
-window.show()
-sys.exit(app.exec_())
\ No newline at end of file
+if __name__ == "__main__":
+    app = QApplication(sys.argv)
+    window = DCPMain()
+    window.show()
+    QTimer.singleShot(0, window.warm_up)
+    sys.exit(app.exec_())
@@ -0,0 +1,133 @@
+import numpy as np
+from PyQt5.QtWidgets import QWidget
+from PyQt5.QtGui import QPainter, QImage, QColor
+from PyQt5.QtCore import Qt, QRectF, pyqtSignal
+from DCPConstants import DCPConstants
+
+
+class DCPMapCanvas(QWidget):
+    # Grid_id under the cursor, -1 outside the grid
+    cell_hovered = pyqtSignal(int)
+
+    # Colour ramp anchors (RGB), low to high
+    RAMP = [(68, 1, 84), (59, 82, 139), (33, 145, 140), (94, 201, 98), (253, 231, 37)]
+    GRID_COLOUR = (200, 200, 200, 255)
+    NODATA_COLOUR = (255, 0, 255, 255)
+
+    def __init__(self, parent=None):
+        super(DCPMapCanvas, self).__init__(parent)
+        self.setMouseTracking(True)
+        self.setMinimumSize(400, 400)
+        self.levels = []  # Cell-id images, north up, each level decimated 2x from the previous
+        self.colours = np.zeros((1, 4), dtype=np.uint8)  # RGBA by Grid_id + 1, row 0 (outside the grid) transparent
+        self.value_range = None
+        self.centre = (0.0, 0.0)  # View centre in finest-level cells
+        self.scale = 1.0  # Screen pixels per finest-level cell
+        self.drag = None
+
+    def set_grid(self, lookup):
+        # The locator's lookup[row, col] already is the rasterized grid, row 0 in the south
+        self.levels = [np.ascontiguousarray(lookup[::-1])]
+        while max(self.levels[-1].shape) > DCPConstants.MAP_OVERVIEW_SIZE:
+            self.levels.append(np.ascontiguousarray(self.levels[-1][::2, ::2]))
+        self.colours = np.zeros((int(lookup.max()) + 2, 4), dtype=np.uint8)
+        self.show_grid()
+        self.fit()
+
+    def show_grid(self):
+        self.colours[1:] = self.GRID_COLOUR
+        self.value_range = None
+        self.update()
+
+    def set_values(self, grid_ids, values):
+        # Only the colour table changes; the cell-id images are reused for every feature and date
+        grid_ids, values = np.asarray(grid_ids, dtype=np.int64), np.asarray(values, dtype=float)
+        known = (grid_ids >= 0) & (grid_ids < len(self.colours) - 1)
+        grid_ids, values = grid_ids[known], values[known]
+        self.colours[1:] = self.GRID_COLOUR
+        finite = np.isfinite(values)
+        if finite.any():
+            low, high = values[finite].min(), values[finite].max()
+            position = (values[finite] - low) / ((high - low) or 1) * 255
+            self.colours[grid_ids[finite] + 1] = self.colour_ramp()[position.astype(np.int64)]
+            self.value_range = (low, high)
+        else:
+            self.value_range = None
+        self.colours[grid_ids[~finite] + 1] = self.NODATA_COLOUR
+        self.update()
+
+    def colour_ramp(self):
+        anchors = np.array(self.RAMP, dtype=float)
+        steps = np.linspace(0, len(anchors) - 1, 256)
+        rgb = np.stack([np.interp(steps, np.arange(len(anchors)), anchors[:, band]) for band in range(3)], axis=1)
+        return np.concatenate([rgb, np.full((256, 1), 255)], axis=1).astype(np.uint8)
+
+    def fit(self):
+        if not self.levels:
+            return
+        n_rows, n_cols = self.levels[0].shape
+        self.centre = (n_cols / 2, n_rows / 2)
+        self.scale = min(self.width() / n_cols, self.height() / n_rows)
+        self.update()
+
+    def to_cells(self, x, y):
+        # Screen position -> finest-level (col, row)
+        return (self.centre[0] + (x - self.width() / 2) / self.scale,
+                self.centre[1] + (y - self.height() / 2) / self.scale)
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.fillRect(self.rect(), Qt.white)
+        if not self.levels:
+            return
+
+        # Coarsest level that still has at least one cell per screen pixel
+        level = min(max(int(np.floor(np.log2(1 / self.scale))), 0), len(self.levels) - 1)
+        step = 2 ** level
+        image = self.levels[level]
+
+        # Only the visible window of that level is coloured and drawn
+        x0, y0 = self.to_cells(0, 0)
+        x1, y1 = self.to_cells(self.width(), self.height())
+        col0, row0 = max(int(np.floor(x0 / step)), 0), max(int(np.floor(y0 / step)), 0)
+        col1, row1 = min(int(np.ceil(x1 / step)), image.shape[1]), min(int(np.ceil(y1 / step)), image.shape[0])
+        if col1 > col0 and row1 > row0:
+            rgba = np.ascontiguousarray(self.colours[image[row0:row1, col0:col1] + 1])
+            qimage = QImage(rgba.data, col1 - col0, row1 - row0, 4 * (col1 - col0), QImage.Format_RGBA8888)
+            target = QRectF((col0 * step - x0) * self.scale, (row0 * step - y0) * self.scale,
+                            (col1 - col0) * step * self.scale, (row1 - row0) * step * self.scale)
+            painter.drawImage(target, qimage)
+
+        if self.value_range:
+            painter.setPen(QColor(0, 0, 0))
+            painter.drawText(8, self.height() - 8, f"{self.value_range[0]:.4g} - {self.value_range[1]:.4g}")
+
+    def wheelEvent(self, event):
+        # Zoom around the cursor
+        x, y = event.pos().x(), event.pos().y()
+        before = self.to_cells(x, y)
+        self.scale *= 1.25 ** (event.angleDelta().y() / 120)
+        after = self.to_cells(x, y)
+        self.centre = (self.centre[0] + before[0] - after[0], self.centre[1] + before[1] - after[1])
+        self.update()
+
+    def mousePressEvent(self, event):
+        self.drag = event.pos()
+
+    def mouseReleaseEvent(self, event):
+        self.drag = None
+
+    def mouseDoubleClickEvent(self, event):
+        self.fit()
+
+    def mouseMoveEvent(self, event):
+        if self.drag is not None:
+            delta = event.pos() - self.drag
+            self.centre = (self.centre[0] - delta.x() / self.scale, self.centre[1] - delta.y() / self.scale)
+            self.drag = event.pos()
+            self.update()
+        elif self.levels:
+            col, row = (int(np.floor(value)) for value in self.to_cells(event.pos().x(), event.pos().y()))
+            n_rows, n_cols = self.levels[0].shape
+            inside = 0 <= row < n_rows and 0 <= col < n_cols
+            self.cell_hovered.emit(int(self.levels[0][row, col]) if inside else -1)
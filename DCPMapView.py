@@ -0,0 +1,92 @@
+import os
+from PyQt5.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout, QComboBox, QDateEdit, QPushButton, QLabel, QMessageBox
+from PyQt5.QtCore import QDate
+from DCPGridLocator import DCPGridLocator
+from DCPMapCanvas import DCPMapCanvas
+
+
+class DCPMapView(QWidget):
+    GRID = "Grid"
+
+    def __init__(self, province, year, parent=None):
+        super(DCPMapView, self).__init__(parent)
+        self.province = province
+        self.year = int(year)
+        self.directory = province.replace(" ", "_")
+        self.query = self.load_query()
+        self.values = {}  # Grid_id -> value of the feature on display, for the hover label
+        self.initUI()
+
+        self.canvas.set_grid(DCPGridLocator.load_or_build(self.directory).lookup)
+
+    def initUI(self):
+        self.setWindowTitle(f'Map preview - {self.province} {self.year}')
+        self.setGeometry(150, 150, 800, 700)
+        layout = QVBoxLayout()
+
+        # Feature and date selection
+        control_layout = QHBoxLayout()
+        self.feature_combo_box = QComboBox()
+        self.feature_combo_box.addItems([self.GRID] + self.dataset_columns())
+        self.date_input = QDateEdit(QDate(self.year, 1, 1))
+        self.date_input.setDateRange(QDate(self.year, 1, 1), QDate(self.year, 12, 31))
+        self.date_input.setCalendarPopup(True)
+        self.show_button = QPushButton("Show")
+        self.show_button.clicked.connect(self.show_feature)
+        control_layout.addWidget(QLabel("Feature:"))
+        control_layout.addWidget(self.feature_combo_box)
+        control_layout.addWidget(QLabel("Date:"))
+        control_layout.addWidget(self.date_input)
+        control_layout.addWidget(self.show_button)
+
+        self.canvas = DCPMapCanvas(self)
+        self.canvas.cell_hovered.connect(self.show_cell)
+        self.cell_label = QLabel("")
+
+        layout.addLayout(control_layout)
+        layout.addWidget(self.canvas)
+        layout.addWidget(self.cell_label)
+        self.setLayout(layout)
+
+    def load_query(self):
+        # Feature overlays read the Parquet dataset through pyarrow; without it only the grid is shown
+        try:
+            from DCPQuery import DCPQuery
+        except ImportError:
+            QMessageBox.warning(self, "pyarrow Missing", "pyarrow is not installed, only the grid can be shown.")
+            return None
+        return DCPQuery()
+
+    def dataset_columns(self):
+        # Feature columns of the generated Parquet dataset, none if it was not exported
+        if self.query is None:
+            return []
+        path = self.query.dataset_path(self.province, self.year)
+        if not os.path.isdir(path):
+            return []
+        import pyarrow.dataset as ds
+        return [name for name in ds.dataset(path, format="parquet").schema.names if name not in ("Grid_id", "date")]
+
+    def show_feature(self):
+        feature = self.feature_combo_box.currentText()
+        self.values = {}
+        if feature == self.GRID:
+            self.canvas.show_grid()
+            return
+
+        # One date of one column is read; the grid image is only recoloured
+        date = self.date_input.date().toPyDate()
+        frame = self.query.query(self.year, self.province, start=date, end=date, features=[feature])
+        if frame.empty:
+            QMessageBox.information(self, "No Data", f"{feature} has no values on {date}.")
+        grid_ids, values = frame["Grid_id"].to_numpy(), frame[feature].to_numpy(dtype=float)
+        self.values = dict(zip(grid_ids.tolist(), values.tolist()))
+        self.canvas.set_values(grid_ids, values)
+
+    def show_cell(self, grid_id):
+        if grid_id < 0:
+            self.cell_label.setText("")
+        elif grid_id in self.values:
+            self.cell_label.setText(f"Grid_id {grid_id}: {self.values[grid_id]:.4g}")
+        else:
+            self.cell_label.setText(f"Grid_id {grid_id}")
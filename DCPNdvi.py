@@ -1,54 +1,109 @@
 import pandas as pd
 import numpy as np
 import geopandas as gpd
-from shapely.geometry import Point
+from pyproj import Transformer
 from datetime import datetime, timedelta
 from sentinelhub import (
-    SHConfig,
     DataCollection,
     SentinelHubRequest,
     BBox,
     CRS,
     MimeType
 )
-from dotenv import load_dotenv
-import os
 from DCPConstants import DCPConstants
+from DCPCdseClient import DCPCdseClient
 from DCPHelper import DCPHelper
+from DCPProfiler import DCPProfiler
+from DCPNdviStatistics import DCPNdviStatistics
+from DCPGridLocator import DCPGridLocator
+from DCPPipeline import DCPPipeline
 
 class DCPNdvi:
-    def __init__(self, province, year, months):
+    # Transfer encoding -> (sample type, scale, offset, no-data value)
+    NDVI_ENCODINGS = {
+        "float32": ("FLOAT32", 1, 0, "NaN"),
+        "int16": ("INT16", 10000, 0, -32768),
+        "uint8": ("UINT8", 127, 1, 255),
+    }
+
+    # Scene classification classes masked out of the composites: cloud shadow, cloud (medium, high), cirrus
+    CLOUD_CLASSES = [3, 8, 9, 10]
+
+    def __init__(self, province, year, months, profiler=None, backend=DCPConstants.NDVI_BACKEND,
+                 encoding=DCPConstants.NDVI_ENCODING, multitemporal=DCPConstants.NDVI_MULTITEMPORAL):
         self.province=province
         self.year=int(year)
         self.months=[int(DCPConstants.MONTHS_DICT[month]) for month in months]
+        self.backend=backend  # "process" downloads images, "statistics" asks for per-cell statistics
+        self.encoding=encoding  # "float32", "int16" or "uint8"
+        self.multitemporal=multitemporal  # None, "month" or "season": one request per period instead of per week
         self.directory = self.province.replace(" ", "_")
+        self.profiler = profiler or DCPProfiler(self.directory, enabled=False)
 
     def generate_dataset(self):
+        self.generate_weekly_data()
+        with self.profiler.stage("ndvi_daily") as stage:
+            out_df=self.create_daily_data()
+            stage.add_cells(len(self.merged_df))
+            stage.add_rows(len(out_df))
+        return out_df
+
+    def register(self, cube):
+        cube.add_source(self.generate_arrays)
+
+    def generate_arrays(self):
+        # Weekly values stay (cells, weeks); the cube maps each date to its week on export
+        self.generate_weekly_data()
+        arrays = {feature: (weekly, self.week_index()) for feature, weekly in self.weekly_arrays().items()}
+        return self.merged_df['Grid_id'].to_numpy(), arrays
+
+    def weekly_arrays(self):
+        # (cells, weeks) array per feature; std and count only come from the statistics backend
+        arrays = {}
+        for feature in ['NDVI', 'NDVI_std', 'NDVI_count']:
+            columns = [f'{feature}_{col}' for col in range(1, len(self.weeks) + 1)]
+            if set(columns) <= set(self.merged_df.columns):
+                arrays[feature] = self.merged_df[columns].to_numpy()
+        return arrays
+
+    def week_index(self):
+        return np.repeat(np.arange(len(self.weeks)), [len(week) for week in self.weeks])
+
+    def generate_weekly_data(self):
         self.create_config_params()
         self.generate_dates()
-        all_df=[]
+        if self.backend == "statistics":
+            statistics = DCPNdviStatistics(self.grid_layer, self.weeks, self.client, self.profiler,
+                                           DCPConstants.NDVI_STATS_URL)
+            self.merged_df = statistics.generate_weekly()
+            return
+
+        # Pixel to Grid_id lookup shared by every sampling worker, computed once up front
+        self.pixel_grid_ids()
+
+        # The next week (or period) downloads while the previous one is decoded and sampled
+        if self.multitemporal:
+            pipeline = DCPPipeline(self.download_period_ndvi, self.sample_period_ndvi)
+            self.merged_df = DCPHelper.merge_grid_id('inner', pipeline.run(self.week_periods()))
+            return
+
+        weeks = []
         col=1
         for week in self.weeks:
             col_name = f'NDVI_{col}'
             start=str(week[0].date())
             end=str(week[-1].date())
-            week_df=self.create_weekly_ndvi(start,end,col_name)
-            all_df.append(week_df)
+            weeks.append((start, end, col_name))
             col+=1
+        all_df = DCPPipeline(self.download_weekly_ndvi, self.sample_weekly_image).run(weeks)
 
         # Merge all datasets on grid_id
         self.merged_df=DCPHelper.merge_grid_id('inner', all_df)
-        out_df=self.create_daily_data()
-        return out_df
 
     def create_config_params(self):
         self.grid_layer = gpd.read_file(f'{self.directory}/clippedGrid.shp')
-        load_dotenv()
-        self.config = SHConfig()
-        self.config.sh_client_id = os.getenv("CLIENT_ID")
-        self.config.sh_client_secret = os.getenv("CLIENT_SECRET")
-        self.config.sh_base_url = 'https://sh.dataspace.copernicus.eu'
-        self.config.sh_token_url = 'https://identity.dataspace.copernicus.eu/auth/realms/CDSE/protocol/openid-connect/token'
+        self.client = DCPCdseClient.shared()
+        self.config = self.client.sh_config()
 
         bbox_data = DCPConstants.PROVINCE_DICT[self.province]
         self.bbox = (bbox_data[1], bbox_data[2], bbox_data[3], bbox_data[0])  # [West, South, East, North]
@@ -103,39 +158,136 @@ class DCPNdvi:
                     continue
                 k += 1
 
-    def create_weekly_ndvi(self, start_date, end_date, col_name):
-        evalscript_ndvi = """
+    def week_periods(self):
+        # (first, last) week positions covered by each multi-temporal request
+        if self.multitemporal == "season":
+            return [(0, len(self.weeks))]
+        periods = []
+        for i, week in enumerate(self.weeks):
+            if periods and self.weeks[periods[-1][0]][0].month == week[0].month:
+                periods[-1][1] = i + 1
+            else:
+                periods.append([i, i + 1])
+        return periods
+
+    def create_period_ndvi(self, first, last):
+        return self.sample_period_ndvi((first, last), self.download_period_ndvi((first, last)))
+
+    def download_period_ndvi(self, period):
+        # One ORBIT-mosaicked request; the evalscript bins scenes into the week windows and returns a band per week
+        first, last = period
+        weeks = self.weeks[first:last]
+        request_ndvi_img = SentinelHubRequest(
+            evalscript=self.multitemporal_evalscript(weeks),
+            input_data=[
+                SentinelHubRequest.input_data(
+                    data_collection=DataCollection.SENTINEL2_L2A.define_from(
+                        name="s2l2a", service_url=DCPConstants.CDSE_BASE_URL
+                    ),
+                    time_interval=(str(weeks[0][0].date()), str(weeks[-1][-1].date())),
+                )
+            ],
+            responses=[SentinelHubRequest.output_response("default", MimeType.TIFF)],
+            bbox=self.aoi_bbox,
+            size=self.aoi_size,
+            config=self.config,
+        )
+
+        with self.profiler.stage("ndvi_download") as stage:
+            ndvi_img = self.client.sh_download(request_ndvi_img)
+            stage.add_bytes(ndvi_img[0].nbytes)
+        return ndvi_img[0]
+
+    def sample_period_ndvi(self, period, ndvi_img):
+        first, last = period
+        with self.profiler.stage("ndvi_sample") as stage:
+            ndvi_array = self.decode_ndvi(ndvi_img.reshape(ndvi_img.shape[:2] + (-1,)))
+            self.check_period_ndvi(period, ndvi_array)
+            col_names = [f'NDVI_{col}' for col in range(first + 1, last + 1)]
+            out_df = self.sample_weekly_ndvi(ndvi_array, col_names)
+            stage.add_cells(len(out_df))
+            stage.add_rows(ndvi_array.size)
+        return out_df
+
+    def check_period_ndvi(self, period, ndvi_array):
+        # A response where no scene landed in any week, or every scene in the same week band, means the
+        # evalscript's scene dates did not match the week windows
+        first, last = period
+        valid = ~np.isnan(ndvi_array)
+        if not valid.any():
+            raise ValueError(f"Multi-temporal NDVI for weeks {first + 1}-{last} has no valid pixel")
+        if last - first > 1:
+            bands = np.where(valid, ndvi_array, np.inf)
+            if (bands == bands[..., :1]).all():
+                raise ValueError(f"Multi-temporal NDVI for weeks {first + 1}-{last} is identical in every week")
+
+    def multitemporal_evalscript(self, weeks):
+        sample_type, scale, offset, nodata = self.NDVI_ENCODINGS[self.encoding]
+        week_starts = ", ".join(f'Date.parse("{week[0]:%Y-%m-%d}T00:00:00Z")' for week in weeks)
+        week_ends = ", ".join(f'Date.parse("{week[-1] + timedelta(days=1):%Y-%m-%d}T00:00:00Z")' for week in weeks)
+        encode = "ndvi" if sample_type == "FLOAT32" else f"Math.round((ndvi + {offset}) * {scale})"
+
+        return f"""
         //VERSION=3
-        function setup() {
-          return {
+        const WEEK_STARTS = [{week_starts}];
+        const WEEK_ENDS = [{week_ends}];
+        const CLOUD_CLASSES = {self.CLOUD_CLASSES};
+
+        function setup() {{
+          return {{
             input: [
-              {
-                bands: ["B04", "B08"],
-                units: "REFLECTANCE",
-              },
+              {{
+                bands: ["B04", "B08", "SCL", "dataMask"],
+                units: ["REFLECTANCE", "REFLECTANCE", "DN", "DN"],
+              }},
             ],
-            output: {
+            output: {{
               id: "default",
-              bands: 1,
-              sampleType: SampleType.FLOAT32,
-            },
-          }
-        }
-
-
-        function evaluatePixel(sample) {
-            let val = (sample.B08 - sample.B04) / (sample.B08 + sample.B04);
-            return [val]
-        }
+              bands: {len(weeks)},
+              sampleType: SampleType.{sample_type},
+            }},
+            mosaicking: "ORBIT",
+          }}
+        }}
+
+
+        function evaluatePixel(samples, scenes) {{
+            let sums = new Array(WEEK_STARTS.length).fill(0);
+            let counts = new Array(WEEK_STARTS.length).fill(0);
+            for (let i = 0; i < samples.length; i++) {{
+                let sample = samples[i];
+                if (!sample.dataMask || CLOUD_CLASSES.includes(sample.SCL)) continue;
+                let time = scenes[i].dateFrom.getTime();
+                for (let w = 0; w < WEEK_STARTS.length; w++) {{
+                    if (time >= WEEK_STARTS[w] && time < WEEK_ENDS[w]) {{
+                        sums[w] += (sample.B08 - sample.B04) / (sample.B08 + sample.B04);
+                        counts[w] += 1;
+                        break;
+                    }}
+                }}
+            }}
+            // Cloud-free mean per week, the no-data value where no clear scene was found
+            return sums.map((sum, w) => {{
+                if (!counts[w]) return {nodata};
+                let ndvi = sum / counts[w];
+                return {encode};
+            }});
+        }}
 
         """
 
+    def create_weekly_ndvi(self, start_date, end_date, col_name):
+        week = (start_date, end_date, col_name)
+        return self.sample_weekly_image(week, self.download_weekly_ndvi(week))
+
+    def download_weekly_ndvi(self, week):
+        start_date, end_date, _ = week
         request_ndvi_img = SentinelHubRequest(
-            evalscript=evalscript_ndvi,
+            evalscript=self.ndvi_evalscript(),
             input_data=[
                 SentinelHubRequest.input_data(
                     data_collection=DataCollection.SENTINEL2_L2A.define_from(
-                        name="s2l2a", service_url="https://sh.dataspace.copernicus.eu"
+                        name="s2l2a", service_url=DCPConstants.CDSE_BASE_URL
                     ),
                     time_interval=(start_date, end_date),
                     other_args={"dataFilter": {"mosaickingOrder": "leastCC"}},
@@ -147,56 +299,94 @@ class DCPNdvi:
             config=self.config,
         )
 
-        ndvi_img = request_ndvi_img.get_data()
-
-        ndvi_array = ndvi_img[0]
+        with self.profiler.stage("ndvi_download") as stage:
+            ndvi_img = self.client.sh_download(request_ndvi_img)
+            stage.add_bytes(ndvi_img[0].nbytes)
+        return ndvi_img[0]
+
+    def sample_weekly_image(self, week, ndvi_img):
+        col_name = week[2]
+        with self.profiler.stage("ndvi_sample") as stage:
+            ndvi_array = self.decode_ndvi(ndvi_img)
+            out_df = self.sample_weekly_ndvi(ndvi_array, col_name)
+            stage.add_cells(len(out_df))
+            stage.add_rows(ndvi_array.size)
+        return out_df
 
-        # Prepare latitude and longitude grid corresponding to the image size
-        latitudes = np.linspace(self.bbox[1], self.bbox[3], self.height_pixels)
-        longitudes = np.linspace(self.bbox[0], self.bbox[2], self.width_pixels)
+    def ndvi_evalscript(self):
+        # NDVI is stored as (ndvi + offset) * scale in a single band, the no-data value where dataMask is off
+        sample_type, scale, offset, nodata = self.NDVI_ENCODINGS[self.encoding]
+        encode = "val" if sample_type == "FLOAT32" else f"Math.round((val + {offset}) * {scale})"
 
-        # Create a mesh grid of latitudes and longitudes
-        lat_grid, lon_grid = np.meshgrid(latitudes, longitudes, indexing="ij")
+        return f"""
+        //VERSION=3
+        function setup() {{
+          return {{
+            input: [
+              {{
+                bands: ["B04", "B08", "dataMask"],
+                units: ["REFLECTANCE", "REFLECTANCE", "DN"],
+              }},
+            ],
+            output: {{
+              id: "default",
+              bands: 1,
+              sampleType: SampleType.{sample_type},
+            }},
+          }}
+        }}
 
-        # Flatten the grids and NDVI array for vectorized DataFrame creation
-        lat_flat = lat_grid.flatten()
-        lon_flat = lon_grid.flatten()
-        ndvi_flat = ndvi_array.flatten()
 
-        # Combine into a DataFrame
-        lat_long_df = pd.DataFrame({
-            "Latitude": lat_flat,
-            "Longitude": lon_flat,
-            col_name: ndvi_flat
-        })
+        function evaluatePixel(sample) {{
+            let val = (sample.B08 - sample.B04) / (sample.B08 + sample.B04);
+            return sample.dataMask && isFinite(val) ? [{encode}] : [{nodata}];
+        }}
 
-        geometry = [Point(xy) for xy in zip(lat_long_df['Longitude'], lat_long_df['Latitude'])]
-        ndvi_gdf = gpd.GeoDataFrame(lat_long_df, geometry=geometry, crs="EPSG:4326")
+        """
 
-        # Ensure both layers have the same CRS
-        ndvi_gdf = ndvi_gdf.to_crs(self.grid_layer.crs)
+    def decode_ndvi(self, ndvi_array):
+        # Back to float32 NDVI with NaN wherever the encoding's no-data value was sent
+        sample_type, scale, offset, nodata = self.NDVI_ENCODINGS[self.encoding]
+        if sample_type == "FLOAT32":
+            return ndvi_array.astype(np.float32, copy=False)
+        ndvi = ndvi_array.astype(np.float32) / scale - offset
+        ndvi[ndvi_array == nodata] = np.nan
+        return ndvi
+
+    def sample_weekly_ndvi(self, ndvi_array, col_names):
+        # One band per column name; a single (rows, cols) image is sampled into one column
+        if isinstance(col_names, str):
+            col_names, ndvi_array = [col_names], ndvi_array[..., np.newaxis]
+
+        # Grid_id of every image pixel, the same for every week
+        pixel_ids = self.pixel_grid_ids()
+        valid = pixel_ids >= 0
+        results = pd.DataFrame({col_name: ndvi_array[..., band].ravel()[valid] for band, col_name in enumerate(col_names)})
+        results['Grid_id'] = pixel_ids[valid]
+
+        # Get the mean NDVI for each Grid_id, cells without any pixel stay NaN
+        out_df = (results.groupby('Grid_id')[col_names].mean()
+                  .reindex(self.grid_layer['id'].to_numpy()).rename_axis('Grid_id').reset_index())
+        return out_df
 
-        # Perform spatial join to get the ID from the shapefile
-        joined = gpd.sjoin(self.grid_layer, ndvi_gdf, how="left", predicate="intersects")
-        results = joined.drop(columns=['geometry', 'index_right', 'Latitude', 'Longitude'])
+    def pixel_grid_ids(self):
+        if getattr(self, '_pixel_ids', None) is None:
+            # Pixel coordinates of the image, row 0 at the northern edge
+            latitudes = np.linspace(self.bbox[3], self.bbox[1], self.height_pixels)
+            longitudes = np.linspace(self.bbox[0], self.bbox[2], self.width_pixels)
+            lat_grid, lon_grid = np.meshgrid(latitudes, longitudes, indexing="ij")
 
-        # Get the mean NDVI for each Grid_id
-        out_df = results.groupby('id', as_index=False)[col_name].mean().rename(columns={'id': 'Grid_id'})
-        return out_df
+            locator = DCPGridLocator.load_or_build(self.directory)
+            transformer = Transformer.from_crs("EPSG:4326", locator.crs, always_xy=True)
+            x, y = transformer.transform(lon_grid.ravel(), lat_grid.ravel())
+            self._pixel_ids = locator.locate(x, y)
+        return self._pixel_ids
 
     def create_daily_data(self):
-        data = []
-        # Assign dates to NDVI rows
-        for _, row in self.merged_df.iterrows():
-            col = 1
-            for week in self.weeks:
-                col_name = f'NDVI_{col}'
-                for day in week:
-                    new_row = {'Grid_id': row['Grid_id'], 'date': day, 'NDVI': row[col_name]}
-                    data.append(new_row)
-                col += 1
-
-        out_df = pd.DataFrame(data)
+        # Assign dates to NDVI rows, every day takes the value of its week
+        arrays = {feature: weekly[:, self.week_index()] for feature, weekly in self.weekly_arrays().items()}
+        dates = [day for week in self.weeks for day in week]
+        out_df = DCPHelper.to_long(self.merged_df['Grid_id'], dates, arrays)
         return out_df
 
 if __name__ == "__main__":
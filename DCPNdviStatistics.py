@@ -0,0 +1,110 @@
+import numpy as np
+import pandas as pd
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor
+from DCPConstants import DCPConstants
+from DCPCdseClient import DCPCdseClient
+from DCPProfiler import DCPProfiler
+
+
+class DCPNdviStatistics:
+    EVALSCRIPT = """
+    //VERSION=3
+    function setup() {
+      return {
+        input: [{bands: ["B04", "B08", "dataMask"]}],
+        output: [
+          {id: "ndvi", bands: 1, sampleType: "FLOAT32"},
+          {id: "dataMask", bands: 1},
+        ],
+      }
+    }
+
+    function evaluatePixel(sample) {
+        let val = (sample.B08 - sample.B04) / (sample.B08 + sample.B04);
+        return {ndvi: [val], dataMask: [sample.dataMask]};
+    }
+    """
+
+    def __init__(self, grid_layer, weeks, client, profiler=None, url=None,
+                 unauthenticated=DCPConstants.NDVI_STATS_UNAUTHENTICATED):
+        self.grid_layer = grid_layer
+        self.weeks = weeks
+        self.profiler = profiler or DCPProfiler(enabled=False)
+        self.url = url or f"{DCPConstants.CDSE_BASE_URL}/api/v1/statistics"
+        # Requests carry the CDSE token unless a stand-in endpoint was explicitly marked as unauthenticated
+        self.client = DCPCdseClient.build_session() if unauthenticated else client
+
+    def generate_weekly(self):
+        # Per-cell weekly mean, standard deviation and valid pixel count, computed server side
+        cells = self.grid_layer.to_crs("EPSG:4326")
+        grid_ids = cells['id'].to_numpy()
+        n_weeks = len(self.weeks)
+        mean = np.full((len(cells), n_weeks), np.nan, dtype=np.float32)
+        std = np.full((len(cells), n_weeks), np.nan, dtype=np.float32)
+        count = np.zeros((len(cells), n_weeks), dtype=np.int32)
+
+        week_starts = {str(week[0].date()): i for i, week in enumerate(self.weeks)}
+        jobs = [(row, geometry, run) for row, geometry in enumerate(cells.geometry) for run in self.week_runs()]
+
+        # The Statistical API takes one geometry per request, so there is one request per cell and run of
+        # weeks; they are sent concurrently over the pooled session and grouped into profiling batches
+        batch = DCPConstants.NDVI_STATS_BATCH
+        with ThreadPoolExecutor(max_workers=DCPConstants.NDVI_STATS_WORKERS) as pool:
+            for start in range(0, len(jobs), batch):
+                with self.profiler.stage("ndvi_statistics") as stage:
+                    for row, response in pool.map(self.request_cell, jobs[start:start + batch]):
+                        stage.add_bytes(len(response.content))
+                        for interval in response.json().get("data", []):
+                            week = week_starts.get(interval["interval"]["from"][:10])
+                            stats = interval.get("outputs", {}).get("ndvi", {}).get("bands", {}).get("B0", {}).get("stats")
+                            if week is None or not stats:
+                                continue
+                            mean[row, week] = float(stats.get("mean", np.nan))
+                            std[row, week] = float(stats.get("stDev", np.nan))
+                            count[row, week] = int(stats.get("sampleCount", 0)) - int(stats.get("noDataCount", 0))
+                    stage.add_cells(len(set(job[0] for job in jobs[start:start + batch])))
+
+        out_df = pd.DataFrame({'Grid_id': grid_ids})
+        for week in range(n_weeks):
+            out_df[f'NDVI_{week + 1}'] = mean[:, week]
+            out_df[f'NDVI_std_{week + 1}'] = std[:, week]
+            out_df[f'NDVI_count_{week + 1}'] = count[:, week]
+        return out_df
+
+    def week_runs(self):
+        # Consecutive 7 day windows can share one request with a P7D aggregation interval
+        runs = [[self.weeks[0]]]
+        for week in self.weeks[1:]:
+            if week[0] - runs[-1][-1][0] == timedelta(days=7):
+                runs[-1].append(week)
+            else:
+                runs.append([week])
+        return [(run[0][0], run[-1][-1] + timedelta(days=1)) for run in runs]
+
+    def request_cell(self, job):
+        row, geometry, (start, end) = job
+        lat = geometry.centroid.y
+        request = {
+            "input": {
+                "bounds": {
+                    "geometry": geometry.__geo_interface__,
+                    "properties": {"crs": "http://www.opengis.net/def/crs/OGC/1.3/CRS84"},
+                },
+                "data": [{
+                    "type": "sentinel-2-l2a",
+                    "dataFilter": {"mosaickingOrder": "leastCC"},
+                }],
+            },
+            "aggregation": {
+                "timeRange": {"from": f"{start:%Y-%m-%d}T00:00:00Z", "to": f"{end:%Y-%m-%d}T00:00:00Z"},
+                "aggregationInterval": {"of": "P7D", "lastIntervalBehavior": "SHORTEN"},
+                "evalscript": self.EVALSCRIPT,
+                # Degrees matching DCPConstants.RESOLUTION at the cell's latitude
+                "resx": DCPConstants.RESOLUTION / (111_320 * np.cos(np.radians(lat))),
+                "resy": DCPConstants.RESOLUTION / 110_574,
+            },
+        }
+        response = self.client.post(self.url, json=request, timeout=DCPConstants.CDSE_TIMEOUT)
+        response.raise_for_status()
+        return row, response
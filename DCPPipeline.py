@@ -0,0 +1,61 @@
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from DCPConstants import DCPConstants
+
+
+class DCPPipeline:
+    def __init__(self, fetch, process, depth=DCPConstants.PIPELINE_DEPTH, fetchers=DCPConstants.PIPELINE_FETCHERS,
+                 workers=DCPConstants.PIPELINE_WORKERS):
+        # fetch(item) does the network part, process(item, fetched) the CPU part on a worker pool.
+        # At most depth items are fetched but not yet processed, so downloads wait instead of piling up.
+        self.fetch = fetch
+        self.process = process
+        self.depth = depth
+        self.fetchers = fetchers
+        self.workers = workers
+
+    def run(self, items):
+        # process() results in item order; items are fetched in order, item N+1 while N is processed
+        items = list(items)
+        if not items:
+            return []
+        slots = threading.Semaphore(self.depth)
+        ready = queue.Queue()
+        positions = iter(range(len(items)))
+        lock = threading.Lock()
+        stop = threading.Event()
+
+        def fetcher():
+            while True:
+                slots.acquire()
+                with lock:
+                    i = None if stop.is_set() else next(positions, None)
+                if i is None:
+                    slots.release()
+                    return
+                try:
+                    ready.put((i, self.fetch(items[i]), None))
+                except Exception as error:
+                    ready.put((i, None, error))
+
+        threads = [threading.Thread(target=fetcher, name=f"DCPFetch-{n}", daemon=True)
+                   for n in range(min(self.fetchers, len(items)))]
+        for thread in threads:
+            thread.start()
+
+        futures = {}
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                for _ in items:
+                    i, fetched, error = ready.get()
+                    if error is not None:
+                        raise error
+                    futures[i] = pool.submit(self.process, items[i], fetched)
+                    futures[i].add_done_callback(lambda _: slots.release())
+                return [futures[i].result() for i in range(len(items))]
+        finally:
+            # Fetchers still waiting for a slot stop once the current downloads finish
+            stop.set()
+            for _ in threads:
+                slots.release()
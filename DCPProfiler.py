@@ -0,0 +1,181 @@
+import os
+import io
+import sys
+import json
+import time
+import cProfile
+import pstats
+import threading
+from contextlib import contextmanager
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+
+class DCPStage:
+    def __init__(self, name, start_wall, start_cpu, parent=None):
+        self.name = name
+        self.parent = parent  # Enclosing stage on the same thread, None at the top level
+        self.start_wall = start_wall
+        self.start_cpu = start_cpu
+        self.wall_time = 0.0
+        self.cpu_time = 0.0
+        self.peak_rss_mb = None
+        self.bytes_downloaded = 0
+        self.rows = 0
+        self.cells = 0
+        self.thread_id = threading.get_ident()
+
+    def add_bytes(self, nbytes):
+        self.bytes_downloaded += int(nbytes)
+
+    def add_rows(self, rows):
+        self.rows += int(rows)
+
+    def add_cells(self, cells):
+        self.cells += int(cells)
+
+    def to_dict(self):
+        return {
+            "stage": self.name,
+            "parent": self.parent,
+            "wall_time_s": round(self.wall_time, 4),
+            "cpu_time_s": round(self.cpu_time, 4),
+            "peak_rss_mb": self.peak_rss_mb,
+            "bytes_downloaded": self.bytes_downloaded,
+            "rows": self.rows,
+            "cells": self.cells,
+        }
+
+
+class DCPProfiler:
+    # Only one cProfile can be enabled per process (Python 3.12 raises otherwise), so nested or
+    # concurrent stages run unprofiled while another stage holds it
+    _active_profile = None
+    _profile_lock = threading.Lock()
+
+    def __init__(self, directory=".", enabled=True, trace=False, cprofile_stages=None):
+        self.directory = directory
+        self.enabled = enabled
+        self.trace = trace
+        self.cprofile_stages = set(cprofile_stages or [])
+        self.stages = []
+        self.run_start = time.time()
+        self.perf_start = time.perf_counter()
+        self._lock = threading.Lock()
+        self._local = threading.local()  # Per-thread stack of the open stages
+
+    @contextmanager
+    def stage(self, name):
+        # Time a pipeline stage; the yielded DCPStage collects byte/row/cell counters.
+        # Stages nest, e.g. export triggers the lazy extraction stages, and record their parent.
+        stack = self._local.__dict__.setdefault("stack", [])
+        start_wall = time.perf_counter()
+        record = DCPStage(name, start_wall, time.process_time(), stack[-1].name if stack else None)
+        if not self.enabled:
+            yield record
+            return
+
+        profile = None
+        if name in self.cprofile_stages or "*" in self.cprofile_stages:
+            profile = self.start_cprofile()
+        stack.append(record)
+        try:
+            yield record
+        finally:
+            stack.pop()
+            if profile is not None:
+                profile.disable()
+                with DCPProfiler._profile_lock:
+                    DCPProfiler._active_profile = None
+                self.dump_cprofile(name, profile)
+            # process_time is process-wide, so concurrent stages share CPU time
+            record.wall_time = time.perf_counter() - start_wall
+            record.cpu_time = time.process_time() - record.start_cpu
+            record.peak_rss_mb = self.peak_rss_mb()
+            with self._lock:
+                self.stages.append(record)
+
+    def start_cprofile(self):
+        # Enabled cProfile, or None when another stage (or another profiling tool) is already profiling
+        with DCPProfiler._profile_lock:
+            if DCPProfiler._active_profile is not None:
+                return None
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                return None
+            DCPProfiler._active_profile = profile
+            return profile
+
+    def peak_rss_mb(self):
+        # Peak resident set size of the process so far
+        if resource is not None:
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            return round(peak / 2 ** 20 if sys.platform == "darwin" else peak / 1024, 1)  # Bytes on macOS, KiB on Linux
+        if psutil is not None:
+            peak = getattr(psutil.Process().memory_info(), "peak_wset", None)  # Windows only
+            return None if peak is None else round(peak / 2 ** 20, 1)
+        return None
+
+    def dump_cprofile(self, name, profile):
+        safe_name = name.replace(" ", "_").replace("/", "_")
+        profile.dump_stats(f"{self.directory}/profile_{safe_name}.prof")
+
+        # Keep a human readable summary next to the binary stats
+        summary = io.StringIO()
+        pstats.Stats(profile, stream=summary).sort_stats("cumulative").print_stats(30)
+        with open(f"{self.directory}/profile_{safe_name}.txt", "w") as f:
+            f.write(summary.getvalue())
+
+    def report(self):
+        stages = [record.to_dict() for record in self.stages]
+        totals = {}
+        for record in stages:
+            total = totals.setdefault(record["stage"], {"calls": 0, "wall_time_s": 0.0, "cpu_time_s": 0.0,
+                                                        "bytes_downloaded": 0, "rows": 0, "cells": 0})
+            total["calls"] += 1
+            for key in ["wall_time_s", "cpu_time_s", "bytes_downloaded", "rows", "cells"]:
+                total[key] += record[key]
+
+        return {
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.run_start)),
+            "total_wall_time_s": round(time.perf_counter() - self.perf_start, 4),
+            "peak_rss_mb": self.peak_rss_mb(),
+            "stages": stages,
+            "totals": totals,
+        }
+
+    def chrome_trace(self):
+        # Complete ("X") events, loadable in chrome://tracing or Perfetto
+        events = []
+        pid = os.getpid()
+        for record in self.stages:
+            events.append({
+                "name": record.name,
+                "ph": "X",
+                "ts": int((record.start_wall - self.perf_start) * 1e6),
+                "dur": int(record.wall_time * 1e6),
+                "pid": pid,
+                "tid": record.thread_id,
+                "args": record.to_dict(),
+            })
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def save(self, name="run"):
+        if not self.enabled:
+            return
+        with open(f"{self.directory}/{name}_report.json", "w") as f:
+            json.dump(self.report(), f, indent=2)
+
+        if self.trace:
+            with open(f"{self.directory}/{name}_trace.json", "w") as f:
+                json.dump(self.chrome_trace(), f)
@@ -0,0 +1,87 @@
+import os
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+from pyproj import Transformer
+from DCPConstants import DCPConstants
+from DCPGridLocator import DCPGridLocator
+
+
+class DCPQuery:
+    def __init__(self, root="."):
+        # Reads Final_Dataset_{year}.parquet written next to each provincial grid, one file per month
+        self.root = root
+
+    def dataset_path(self, province, year):
+        return f"{self.root}/{province.replace(' ', '_')}/Final_Dataset_{year}.parquet"
+
+    def provinces(self, year):
+        return [province for province in DCPConstants.PROVINCE_DICT
+                if os.path.isdir(self.dataset_path(province, year))]
+
+    def query(self, year, province=None, grid_ids=None, bbox=None, bbox_crs="EPSG:4326",
+              start=None, end=None, features=None, as_arrow=False):
+        # Only the selected columns of the row groups that can match the filters are read.
+        # bbox is (west, south, east, north) in bbox_crs; province None queries every generated province.
+        provinces = [province] if province else self.provinces(year)
+        tables = []
+        for name in provinces:
+            table = self.query_province(name, year, grid_ids, bbox, bbox_crs, start, end, features)
+            if province is None:
+                table = table.append_column("province", pa.array([name] * table.num_rows, pa.string()))
+            tables.append(table)
+        table = pa.concat_tables(tables) if len(tables) > 1 else tables[0] if tables else pa.table({})
+        return table if as_arrow else table.to_pandas()
+
+    def query_province(self, province, year, grid_ids, bbox, bbox_crs, start, end, features):
+        dataset = ds.dataset(self.dataset_path(province, year), format="parquet")
+
+        ids = None if grid_ids is None else np.unique(np.asarray(grid_ids, dtype=np.int64))
+        if bbox is not None:
+            cells = self.bbox_grid_ids(province, bbox, bbox_crs)
+            ids = cells if ids is None else np.intersect1d(ids, cells)
+
+        conditions = []
+        if ids is not None:
+            if not len(ids):
+                return dataset.schema.empty_table().select(self.columns(dataset, features))
+            # The range lets row group min/max statistics prune before the set test
+            grid_type = dataset.schema.field("Grid_id").type
+            conditions += [ds.field("Grid_id") >= pa.scalar(ids[0], grid_type),
+                           ds.field("Grid_id") <= pa.scalar(ids[-1], grid_type),
+                           ds.field("Grid_id").isin(pa.array(ids, grid_type))]
+        date_type = dataset.schema.field("date").type
+        if start is not None:
+            conditions.append(ds.field("date") >= pa.scalar(pd.Timestamp(start), date_type))
+        if end is not None:
+            conditions.append(ds.field("date") <= pa.scalar(pd.Timestamp(end), date_type))
+
+        condition = None
+        for expression in conditions:
+            condition = expression if condition is None else condition & expression
+        return dataset.to_table(columns=self.columns(dataset, features), filter=condition)
+
+    def columns(self, dataset, features):
+        # Feature names (DCPConstants.FEATURES_LIST) select the columns they write, e.g. NDVI also brings
+        # NDVI_std and NDVI_count when they were generated; any other name selects that column
+        if features is None:
+            return dataset.schema.names
+        columns = ["Grid_id", "date"]
+        for feature in features:
+            columns += [name for name in DCPConstants.FEATURE_COLUMNS.get(feature, [feature])
+                        if name in dataset.schema.names and name not in columns]
+        return columns
+
+    def bbox_grid_ids(self, province, bbox, bbox_crs):
+        # Grid cells whose lattice square overlaps the bbox, read from the locator instead of the shapefile
+        locator = DCPGridLocator.load_or_build(f"{self.root}/{province.replace(' ', '_')}")
+        west, south, east, north = bbox
+        transformer = Transformer.from_crs(bbox_crs, locator.crs, always_xy=True)
+        xs, ys = transformer.transform([west, west, east, east], [south, north, south, north])
+
+        n_rows, n_cols = locator.lookup.shape
+        col0, col1 = np.floor((np.array([min(xs), max(xs)]) - locator.origin[0]) / locator.step[0]).astype(int)
+        row0, row1 = np.floor((np.array([min(ys), max(ys)]) - locator.origin[1]) / locator.step[1]).astype(int)
+        window = locator.lookup[max(row0, 0):min(row1 + 1, n_rows), max(col0, 0):min(col1 + 1, n_cols)]
+        return np.unique(window[window >= 0])
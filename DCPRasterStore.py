@@ -0,0 +1,56 @@
+import os
+import json
+import threading
+import numpy as np
+from affine import Affine
+from rasterio.crs import CRS
+
+
+class DCPRasterStore:
+    def __init__(self, directory):
+        # One .npy per (variable, year, month, grid) plus a small JSON index with the georeferencing
+        self.directory = f"{directory}/raster_store"
+        self.index_path = f"{self.directory}/index.json"
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+        self.index = self.read_index()
+
+    def read_index(self):
+        if not os.path.exists(self.index_path):
+            return {}
+        with open(self.index_path) as f:
+            return json.load(f)
+
+    def key(self, variable, year, month, grid):
+        return f"{variable}_{year}_{int(month):02}_{grid}"
+
+    def has(self, variable, year, month, grid):
+        key = self.key(variable, year, month, grid)
+        return key in self.index and os.path.exists(f"{self.directory}/{key}.npy")
+
+    def save(self, variable, year, month, grid, cube, transform, crs):
+        key = self.key(variable, year, month, grid)
+        tmp_path = f"{self.directory}/{key}.{os.getpid()}.npy"
+        np.save(tmp_path, np.ascontiguousarray(cube, dtype=np.float32))
+        os.replace(tmp_path, f"{self.directory}/{key}.npy")
+
+        with self._lock:
+            # Merge with entries written by other processes since this store was opened
+            self.index = {**self.read_index(), **self.index}
+            self.index[key] = {
+                "shape": list(cube.shape),
+                "dtype": "float32",
+                "transform": list(transform)[:6],
+                "crs": crs.to_wkt(),
+            }
+            tmp_index = f"{self.index_path}.{os.getpid()}.tmp"
+            with open(tmp_index, "w") as f:
+                json.dump(self.index, f, indent=1)
+            os.replace(tmp_index, self.index_path)
+
+    def load(self, variable, year, month, grid):
+        # Read-only memory map, pages are only read when the sampler touches them
+        key = self.key(variable, year, month, grid)
+        meta = self.index[key]
+        cube = np.load(f"{self.directory}/{key}.npy", mmap_mode="r")
+        return cube, Affine(*meta["transform"]), CRS.from_wkt(meta["crs"])
@@ -0,0 +1,119 @@
+import os
+import numpy as np
+import pandas as pd
+from DCPConstants import DCPConstants
+from DCPHelper import DCPHelper
+from DCPDatasetStore import DCPDatasetStore
+from DCPGridLocator import DCPGridLocator
+from DCPFire import DCPFire
+
+
+class DCPSampler:
+    def __init__(self, province, year, months, columns=None, batch_size=DCPConstants.SAMPLER_BATCH_SIZE,
+                 negative_ratio=DCPConstants.SAMPLER_NEGATIVE_RATIO, region_cells=DCPConstants.SAMPLER_REGION_CELLS,
+                 seed=None):
+        # Class-balanced (Grid_id, date) batches gathered from the Final_Dataset_{year} partitions.
+        # Positives come from the fire index, negatives are drawn per (month, region) stratum.
+        self.province = province
+        self.directory = province.replace(" ", "_")
+        self.year = int(year)
+        self.months = [DCPConstants.MONTHS_DICT[month] for month in months]
+        self.batch_size = batch_size
+        self.negative_ratio = negative_ratio
+        self.rng = np.random.default_rng(seed)
+
+        grid_path = f"{self.directory}/Final_Dataset_{self.year}/grid_ids.npy"
+        if not os.path.exists(grid_path):
+            raise ValueError(f"No dataset store for {province} {self.year}, generate it with APPEND_MODE enabled")
+        self.grid_ids = np.load(grid_path)
+        self.store = DCPDatasetStore(self.directory, self.year, self.grid_ids)
+        self.columns = columns or self.stored_columns()
+        self.arrays = {}
+
+        self.dates = pd.DatetimeIndex(DCPHelper.month_dates(self.year, self.months))
+        self.positives = self.fire_index(months)
+        self.strata = self.build_strata(region_cells)
+
+    def stored_columns(self):
+        missing = [month for month in self.months if month not in self.store.index["partitions"]]
+        if missing:
+            raise ValueError(f"Months {missing} are not in the dataset store")
+        stored = set.intersection(*[set(self.store.columns(month)) for month in self.months])
+        return sorted((stored | set(self.store.columns(DCPDatasetStore.STATIC))) - {"ignition"})
+
+    def fire_index(self, months):
+        # Sorted flat (cell, day) keys of every ignition on the store grid
+        fire_df = DCPFire(self.province, self.year, months).generate_dataset()
+        cells = pd.Index(self.grid_ids).get_indexer(fire_df["Grid_id"])
+        days = self.dates.get_indexer(fire_df["date"].dt.normalize())
+        found = (cells >= 0) & (days >= 0)
+        return np.unique(cells[found].astype(np.int64) * len(self.dates) + days[found])
+
+    def build_strata(self, region_cells):
+        # Regions are blocks of region_cells x region_cells lattice cells; every (month, region)
+        # stratum keeps its cells and day range so negatives can be drawn without enumerating them
+        n_rows = DCPGridLocator.load_or_build(self.directory).lookup.shape[0]
+        col, row = np.divmod(self.grid_ids.astype(np.int64), n_rows)
+        region = pd.factorize(pd.MultiIndex.from_arrays([col // region_cells, row // region_cells]))[0]
+        order = np.argsort(region, kind="stable")
+        bounds = np.flatnonzero(np.diff(region[order])) + 1
+        regions = np.split(order, bounds)
+
+        month_of_date = self.dates.month.to_numpy()
+        strata = []
+        for month in self.months:
+            days = np.flatnonzero(month_of_date == int(month))
+            for cells in regions:
+                strata.append((cells, days[0], days[-1] + 1))
+        sizes = np.array([len(cells) * (stop - start) for cells, start, stop in strata], dtype=float)
+        return strata, sizes / sizes.sum()
+
+    def sample_negatives(self, count):
+        # Proportional allocation over strata, then uniform cell-days inside each; fires are redrawn
+        strata, weights = self.strata
+        keys = []
+        for stratum, n in enumerate(self.rng.multinomial(count, weights)):
+            cells, start, stop = strata[stratum]
+            while n:
+                drawn = (self.rng.choice(cells, n).astype(np.int64) * len(self.dates)
+                         + self.rng.integers(start, stop, n))
+                drawn = drawn[~np.isin(drawn, self.positives)]
+                keys.append(drawn)
+                n -= len(drawn)
+        return np.concatenate(keys) if keys else np.empty(0, dtype=np.int64)
+
+    def batches(self, epochs=1):
+        # Every positive once per epoch, each batch topped up with fresh negatives
+        n_positive = max(1, int(round(self.batch_size / (1 + self.negative_ratio))))
+        for _ in range(epochs):
+            positives = self.rng.permutation(self.positives)
+            for start in range(0, len(positives), n_positive):
+                batch_positives = positives[start:start + n_positive]
+                negatives = self.sample_negatives(self.batch_size - len(batch_positives))
+                yield self.gather(batch_positives, negatives)
+
+    def gather(self, positives, negatives):
+        # Read only the sampled cell-days from the memory-mapped partitions
+        keys = np.concatenate([positives, negatives])
+        cells, days = np.divmod(keys, len(self.dates))
+        months = self.dates.month.to_numpy()[days]
+        month_days = self.dates.day.to_numpy()[days] - 1
+
+        batch = pd.DataFrame({"Grid_id": self.grid_ids[cells], "date": self.dates[days]})
+        for column in self.columns:
+            if self.store.has(DCPDatasetStore.STATIC, column):
+                batch[column] = self.array(DCPDatasetStore.STATIC, column)[cells]
+                continue
+            values = np.empty(len(keys), dtype=np.float32)
+            for month in np.unique(months):
+                rows = months == month
+                values[rows] = self.array(f"{month:02}", column)[cells[rows], month_days[rows]]
+            batch[column] = values
+        batch["ignition"] = np.repeat(np.array([1, 0], dtype=np.uint8), [len(positives), len(negatives)])
+        return batch
+
+    def array(self, partition, column):
+        if (partition, column) not in self.arrays:
+            self.arrays[(partition, column)] = np.load(f"{self.store.directory}/{partition}/{column}.npy",
+                                                       mmap_mode="r")
+        return self.arrays[(partition, column)]
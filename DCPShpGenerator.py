@@ -3,6 +3,8 @@ import geopandas as gpd
 import math
 from shapely.geometry import Polygon
 from DCPConstants import DCPConstants
+from DCPGridPyramid import DCPGridPyramid
+from DCPGridLocator import DCPGridLocator
 
 class DCPShpGenerator:
     def __init__(self, province: str, selected_file: str):
@@ -20,6 +22,14 @@ class DCPShpGenerator:
             provincial_gdf=data.copy()
             provincial_gdf.to_file(output_file) # Save the provincial shp file
 
+            if DCPConstants.GRID_PYRAMID:
+                # The finest level doubles as clippedGrid, the one every extraction stage reads
+                grids = DCPGridPyramid(self.directory).build(provincial_gdf, DCPConstants.GRID_PYRAMID)
+                self.clipped_grid = grids[min(grids)]
+                self.clipped_grid.to_file(f"{self.directory}/clippedGrid.shp")
+                DCPGridLocator.rebuild(self.directory)
+                return
+
             # Get the bounding box of the dataset
             minx, miny, maxx, maxy = provincial_gdf.total_bounds
             horizontal_spacing, vertical_spacing = DCPConstants.GRID_SIZE
@@ -39,6 +49,9 @@ class DCPShpGenerator:
             self.clipped_grid = gpd.clip(grid, provincial_gdf)
             self.clipped_grid['id'] = self.clipped_grid.index
             self.clipped_grid.to_file(f"{self.directory}/clippedGrid.shp")
+
+            # Lattice origin, step and (row, col) -> Grid_id, for point-to-cell assignment without sjoin
+            DCPGridLocator.rebuild(self.directory)
         return
 
     def create_provincial_centroids(self):
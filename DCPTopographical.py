@@ -1,5 +1,3 @@
-from oauthlib.oauth2 import BackendApplicationClient
-from requests_oauthlib import OAuth2Session
 import rasterio
 from rasterio.warp import calculate_default_transform
 import numpy as np
@@ -7,31 +5,61 @@ import pandas as pd
 import geopandas as gpd
 from rasterio.mask import mask
 import rasterstats as rs
-from dotenv import load_dotenv
 import os
 from DCPConstants import DCPConstants
+from DCPCdseClient import DCPCdseClient
+from DCPProfiler import DCPProfiler
+from DCPDemMirror import DCPDemMirror
 
 
 class DCPTopographical:
-    def __init__(self, province, features):
+    # Feature -> output column
+    COLUMNS = {"Elevation": "elevation", "Slope": "slope", "Aspect": "aspect"}
+
+    def __init__(self, province, features, profiler=None, source=DCPConstants.DEM_SOURCE):
         self.province = province
         self.features = features
+        self.source = source  # "remote" or "mirror"
         self.directory = self.province.replace(" ", "_")
+        self.profiler = profiler or DCPProfiler(self.directory, enabled=False)
 
     def generate_dataset(self):
         self.image_file=f'{self.directory}/output_image.tif'
-        if not os.path.exists(self.image_file):
-            self.generate_dem()
+        if not os.path.exists(self.image_file) and self.source == "mirror":
+            DCPDemMirror(DCPConstants.DEM_MIRROR_DIR, profiler=self.profiler).write_province(self.province, self.image_file)
+        elif not os.path.exists(self.image_file):
+            with self.profiler.stage("dem_download") as stage:
+                self.generate_dem()
+                if os.path.exists(self.image_file):
+                    stage.add_bytes(os.path.getsize(self.image_file))
 
         self.elev_output_path= f'{self.directory}/DEM.tif'
         if not os.path.exists(self.elev_output_path):
-            self.clip_dem()
+            with self.profiler.stage("dem_clip"):
+                self.clip_dem()
 
         if {"Slope", "Aspect"} & set(self.features):
             self.slope_output_path = f'{self.directory}/slope.tif'
             self.aspect_output_path = f'{self.directory}/aspect.tif'
-            self.slope_aspect()
+            with self.profiler.stage("dem_slope_aspect"):
+                self.slope_aspect()
+
+        with self.profiler.stage("dem_zonal_stats") as stage:
+            zonal_means = self.zonal_statistics()
+            stage.add_cells(len(zonal_means))
+            stage.add_rows(len(zonal_means))
+        return zonal_means
+
+    def register(self, cube):
+        cube.add_source(self.generate_arrays)
 
+    def generate_arrays(self):
+        # Static features, broadcast along date by the cube
+        zonal_means = self.generate_dataset()
+        grid_ids = zonal_means.pop('Grid_id').to_numpy()
+        return grid_ids, {column: zonal_means[column].to_numpy(dtype=float) for column in zonal_means.columns}
+
+    def zonal_statistics(self):
         # Load the centroids shapefile
         clipped_grid_path = f'{self.directory}/clippedGrid.shp'
         clipped_grid = gpd.read_file(clipped_grid_path)
@@ -80,16 +108,9 @@ class DCPTopographical:
 
 
     def generate_dem(self):
-        load_dotenv()
-        client_id = os.getenv("CLIENT_ID")
-        client_secret = os.getenv("CLIENT_SECRET")
         bbox_data = DCPConstants.PROVINCE_DICT[self.province]
         bbox = [bbox_data[1], bbox_data[2], bbox_data[3], bbox_data[0]]  # [West, South, East, North]
 
-        # Create an OAuth2 session
-        client = BackendApplicationClient(client_id=client_id)
-        oauth = OAuth2Session(client=client)
-
         # Calculate the spatial extent in meters (approx.)
         lon_diff = bbox[2] - bbox[0]  # East - West
         lat_diff = bbox[3] - bbox[1]  # North - South
@@ -111,34 +132,15 @@ class DCPTopographical:
         if height_pixels > MAX_PIXELS:
             height_pixels = MAX_PIXELS
 
-        # Fetch the OAuth2 access token
+        # Step 2: Fetch (or reuse) the shared access token
+        client = DCPCdseClient.shared()
         try:
-            token = oauth.fetch_token(
-                token_url='https://identity.dataspace.copernicus.eu/auth/realms/CDSE/protocol/openid-connect/token',
-                client_id=client_id,
-                client_secret=client_secret,
-                include_client_id=True
-            )
+            client.get_token()
         except Exception as e:
             print(f"Error fetching token: {e}")
             return
 
-        # Step 2: Fetch the access token
-        if token is None:
-            exit("Failed to obtain access token.")
-
-        # Step 3: Test the API connection
-        try:
-            response = oauth.get("https://sh.dataspace.copernicus.eu/configuration/v1/wms/instances")
-            if response.status_code == 200:
-                print("WMS Instances:", response.content)
-            else:
-                print(f"Error fetching WMS instances: {response.status_code} - {response.content}")
-        except Exception as e:
-            print(f"Error during API request: {e}")
-            return
-
-        # Step 4: Define the evalscript to process DEM data
+        # Step 3: Define the evalscript to process DEM data
         evalscript = """
         //VERSION=3
         function setup() {
@@ -153,7 +155,7 @@ class DCPTopographical:
         }
         """
 
-        # Step 5: Define the POST request payload
+        # Step 4: Define the POST request payload
         request = {
             "input": {
                 "bounds": {
@@ -184,10 +186,10 @@ class DCPTopographical:
             "evalscript": evalscript,
         }
 
-        # Step 6: Send the POST request to process DEM data
-        url = "https://sh.dataspace.copernicus.eu/api/v1/process"
+        # Step 5: Send the POST request to process DEM data
+        url = f"{DCPConstants.CDSE_BASE_URL}/api/v1/process"
         try:
-            response = oauth.post(url, json=request)
+            response = client.post(url, json=request)
             if response.status_code == 200:
                 # Save the processed image to a file
                 with open(f'{self.image_file}', 'wb') as f:
@@ -0,0 +1,62 @@
+import numpy as np
+import geopandas as gpd
+import shapely
+from shapely.geometry import box
+from rasterio.crs import CRS
+from rasterio.transform import from_origin
+from DCPAreaWeights import DCPAreaWeights
+
+
+def clipped_grid():
+    # 30 km lattice clipped to a lat/lon box, in the Canada Atlas Lambert CRS used by the provincial grids
+    area = gpd.GeoSeries([box(-101, 49, -99, 51)], crs="EPSG:4326").to_crs("EPSG:3978")
+    minx, miny, maxx, maxy = area.total_bounds
+    xs, ys = np.meshgrid(np.arange(minx, maxx, 30_000), np.arange(miny, maxy, 30_000), indexing="ij")
+    lattice = gpd.GeoDataFrame(geometry=shapely.box(xs.ravel(), ys.ravel(), xs.ravel() + 30_000, ys.ravel() + 30_000),
+                               crs="EPSG:3978")
+    grid = gpd.clip(lattice, area, keep_geom_type=True)
+    grid["id"] = grid.index
+    return grid
+
+
+def brute_force(grid, cube, transform, crs):
+    # Overlap area of every cell with every projected pixel footprint, NaN pixels left out
+    days, height, width = cube.shape
+    out = np.full((len(grid), days), np.nan)
+    pixels = [(row, col, gpd.GeoSeries([box(*(transform * (col, row + 1)), *(transform * (col + 1, row)))],
+                                       crs=crs).to_crs(grid.crs).iloc[0])
+              for row in range(height) for col in range(width)]
+    for i, cell in enumerate(grid.geometry):
+        for day in range(days):
+            total = weight = 0.0
+            for row, col, pixel in pixels:
+                area = cell.intersection(pixel).area
+                if area > 0 and not np.isnan(cube[day, row, col]):
+                    total += area * cube[day, row, col]
+                    weight += area
+            if weight > 0:
+                out[i, day] = total / weight
+    return out
+
+
+def test_weights_match_a_brute_force_overlay():
+    grid = clipped_grid()
+    transform, crs = from_origin(-101.5, 51.5, 0.25, 0.25), CRS.from_epsg(4326)
+    rng = np.random.default_rng(1)
+    cube = rng.uniform(0, 30, (2, 12, 12)).astype(np.float32)
+    cube[0, 4, 5] = cube[1, 6, 2] = np.nan
+
+    weights = DCPAreaWeights.build(grid, transform, cube.shape[1:], crs)
+    assert np.array_equal(weights.grid_ids, grid["id"].to_numpy())
+    assert np.allclose(weights.apply(cube), brute_force(grid, cube, transform, crs), rtol=1e-5, equal_nan=True)
+
+
+def test_weights_are_cached_per_grid(tmp_path):
+    grid = clipped_grid()
+    grid.to_file(f"{tmp_path}/clippedGrid.shp")
+    transform, crs = from_origin(-101.5, 51.5, 0.25, 0.25), CRS.from_epsg(4326)
+
+    first = DCPAreaWeights.load_or_build(str(tmp_path), transform, (12, 12), crs)
+    assert len(list(tmp_path.glob("area_weights_*.npz"))) == 1
+    again = DCPAreaWeights.load_or_build(str(tmp_path), transform, (12, 12), crs)
+    assert np.array_equal(first.weights, again.weights) and len(list(tmp_path.glob("area_weights_*.npz"))) == 1
@@ -0,0 +1,68 @@
+import numpy as np
+import rasterio
+from rasterio.crs import CRS
+from rasterio.enums import Resampling
+from rasterio.transform import from_bounds
+from DCPConstants import DCPConstants
+from DCPDemMirror import DCPDemMirror
+
+SIZE = 512  # Pixels per side of the synthetic 1x1 degree tile
+
+
+def write_tile(directory, lat, lon, base=500, overview=100):
+    # Tile whose overviews hold a different value from the full-resolution data, so a read shows which it used
+    mirror = DCPDemMirror(str(directory))
+    path = f"{directory}/{mirror.tile_name(lat, lon)}.tif"
+    profile = dict(driver="GTiff", height=SIZE, width=SIZE, count=1, dtype="float32", tiled=True,
+                   crs=CRS.from_epsg(4326), transform=from_bounds(lon, lat, lon + 1, lat + 1, SIZE, SIZE))
+    with rasterio.open(path, "w", **profile) as dst:
+        dst.write(np.full((SIZE, SIZE), overview, dtype=np.float32), 1)
+        dst.build_overviews([2, 4, 8], Resampling.average)
+    with rasterio.open(path, "r+") as dst:
+        dst.write(np.full((SIZE, SIZE), base, dtype=np.float32), 1)
+    return path
+
+
+def test_overview_level():
+    mirror = DCPDemMirror("")
+    res = (1 / SIZE, 1 / SIZE)
+    assert mirror.overview_level(res, [2, 4, 8], res) is None
+    assert mirror.overview_level(res, [2, 4, 8], (1.5 / SIZE, 1.5 / SIZE)) is None
+    assert mirror.overview_level(res, [2, 4, 8], (2 / SIZE, 2 / SIZE)) == 0
+    assert mirror.overview_level(res, [2, 4, 8], (8 / SIZE, 8 / SIZE)) == 2
+    assert mirror.overview_level(res, [2, 4, 8], (100 / SIZE, 100 / SIZE)) == 2
+    # The coarser axis does not decide: northern tiles are coarser in longitude
+    assert mirror.overview_level(res, [2, 4, 8], (8 / SIZE, 4 / SIZE)) == 1
+
+
+def test_coarse_read_uses_the_overview(tmp_path):
+    write_tile(tmp_path, 45, -75)
+    mirror = DCPDemMirror(str(tmp_path), block_rows=16)
+    target_res = (8 / SIZE, 8 / SIZE)
+    vrt_path = mirror.build_vrt(mirror.tiles((-75, 45, -74, 46)), f"{tmp_path}/mirror.vrt", target_res)
+    blocks = list(mirror.read_blocks(vrt_path, (-75, 45, -74, 46), (SIZE // 8, SIZE // 8)))
+    assert [start for start, _ in blocks] == list(range(0, SIZE // 8, 16))
+    assert np.allclose(np.concatenate([block for _, block in blocks]), 100)
+
+
+def test_full_resolution_read_uses_the_base_data(tmp_path):
+    write_tile(tmp_path, 45, -75)
+    mirror = DCPDemMirror(str(tmp_path))
+    res = (1 / SIZE, 1 / SIZE)
+    vrt_path = mirror.build_vrt(mirror.tiles((-75, 45, -74, 46)), f"{tmp_path}/mirror.vrt", res)
+    _, block = next(mirror.read_blocks(vrt_path, (-75, 45, -74, 46), (SIZE, SIZE)))
+    assert np.allclose(block, 500)
+
+
+def test_write_province_scales_to_km_and_fills_the_sea(tmp_path, monkeypatch):
+    write_tile(tmp_path, 45, -75)
+    # Two tiles wide, only the western one exists in the mirror
+    monkeypatch.setitem(DCPConstants.PROVINCE_DICT, "Test", [46, -75, 45, -73])
+    mirror = DCPDemMirror(str(tmp_path), block_rows=8)
+    image_file = mirror.write_province("Test", f"{tmp_path}/dem.tif", resolution=111_320 * 8 / SIZE)
+
+    with rasterio.open(image_file) as src:
+        dem = src.read(1)
+    assert dem.shape == (int(110_574 * SIZE / (111_320 * 8)), 2 * SIZE // 8)
+    assert np.allclose(dem[:, :SIZE // 8 - 1], 0.1)
+    assert np.allclose(dem[:, SIZE // 8 + 1:], 0)
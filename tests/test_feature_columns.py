@@ -0,0 +1,40 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+from DCPConstants import DCPConstants
+from DCPDatacube import DCPDatacube
+from DCPDatasetStore import DCPDatasetStore
+from DCPHelper import DCPHelper
+from DCPQuery import DCPQuery
+
+COLUMNS = ["T", "T_anom", "Prcp", "Prcp_7d", "Prcp_14d", "NDVI", "NDVI_std", "NDVI_count", "elevation"]
+
+
+def test_store_keeps_derived_columns_apart(tmp_path):
+    grid_ids = np.arange(4)
+    store = DCPDatasetStore(str(tmp_path), 2020, grid_ids)
+    cube = DCPDatacube(grid_ids, DCPHelper.month_dates(2020, ["07"]))
+    for column in COLUMNS:
+        cube.add_feature(column, grid_ids, np.zeros(4) if column == "elevation" else np.zeros((4, 31)))
+    store.save(cube, ["07"])
+
+    features = {feature: DCPConstants.FEATURE_COLUMNS[feature] for feature in ["Temperature", "Total Precipitation"]}
+    assert store.stored_columns(["07"], features) == ["T", "Prcp"]
+    assert store.stored_columns(["07"], {"NDVI": DCPConstants.FEATURE_COLUMNS["NDVI"]}) == ["NDVI", "NDVI_std", "NDVI_count"]
+    assert store.missing(["07"], {"Rolling Precipitation": DCPConstants.FEATURE_COLUMNS["Rolling Precipitation"]},
+                         set()) == {"07": ["Rolling Precipitation"]}
+    assert store.missing(["07"], {"Elevation": ["elevation"], "Temperature": ["T"]}, {"Elevation"}) == {}
+
+
+def test_query_selects_the_columns_of_a_feature(tmp_path):
+    table = pa.table({"Grid_id": [0], "date": [pd.Timestamp("2020-07-01")], **{column: [0.0] for column in COLUMNS}})
+    ds.write_dataset(table, f"{tmp_path}/data", format="parquet")
+    dataset = ds.dataset(f"{tmp_path}/data", format="parquet")
+
+    query = DCPQuery(str(tmp_path))
+    assert query.columns(dataset, ["Temperature"]) == ["Grid_id", "date", "T"]
+    assert query.columns(dataset, ["Total Precipitation", "NDVI"]) == ["Grid_id", "date", "Prcp", "NDVI", "NDVI_std",
+                                                                       "NDVI_count"]
+    assert query.columns(dataset, ["T_anom"]) == ["Grid_id", "date", "T_anom"]
+    assert query.columns(dataset, ["Rolling Precipitation"]) == ["Grid_id", "date", "Prcp_7d", "Prcp_14d"]
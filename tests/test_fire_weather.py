@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("cdsapi")
+pytest.importorskip("sentinelhub")
+from DCPFireWeather import DCPFireWeather
+
+# Van Wagner (1987) worked example: April 13, T 17 C, RH 42 %, wind 25 km/h, no rain,
+# from FFMC 85, DMC 6 and DC 15
+REFERENCE = {"FFMC": 87.69, "DMC": 8.55, "DC": 19.01, "ISI": 10.85, "BUI": 8.49, "FWI": 10.1}
+
+
+def weather(n_days):
+    return (np.full((1, n_days), 17.0), np.full((1, n_days), 42.0), np.full((1, n_days), 25.0),
+            np.zeros((1, n_days)), np.full(n_days, 4))
+
+
+def test_reference_day():
+    fire_weather = DCPFireWeather.__new__(DCPFireWeather)
+    codes = fire_weather.fire_weather_index(*weather(1))
+    for column, value in REFERENCE.items():
+        assert codes[column][0, 0] == pytest.approx(value, abs=0.01 if column != "FWI" else 0.05)
+
+
+def test_missing_day_keeps_the_previous_codes():
+    fire_weather = DCPFireWeather.__new__(DCPFireWeather)
+    temp, rh, wind, rain, months = weather(3)
+    temp[0, 1] = np.nan
+    codes = fire_weather.fire_weather_index(temp, rh, wind, rain, months)
+    complete = fire_weather.fire_weather_index(*weather(2))
+
+    # The gap keeps day 1's moisture codes, and day 3 continues from them like an uninterrupted day 2
+    for column in ["FFMC", "DMC", "DC"]:
+        assert codes[column][0, 1] == pytest.approx(codes[column][0, 0])
+        assert codes[column][0, 2] == pytest.approx(complete[column][0, 1])
+    assert not np.isnan(codes["FWI"][0, 2])
+
+
+def test_lag_and_rolling_sum():
+    fire_weather = DCPFireWeather.__new__(DCPFireWeather)
+    array = np.arange(8.0).reshape(2, 4)
+    assert np.array_equal(fire_weather.lag(array, 0), array)
+    assert np.array_equal(fire_weather.lag(array, 1)[:, 1:], array[:, :-1])
+    assert np.isnan(fire_weather.lag(array, 9)).all()
+
+    sums = fire_weather.rolling_sum(array, 2)
+    assert np.isnan(sums[:, 0]).all()
+    assert np.array_equal(sums[:, 1:], array[:, 1:] + array[:, :-1])
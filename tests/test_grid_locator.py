@@ -0,0 +1,43 @@
+import os
+import numpy as np
+import geopandas as gpd
+from shapely.geometry import Polygon
+from DCPGridLocator import DCPGridLocator
+from DCPShpGenerator import DCPShpGenerator
+
+# Irregular province, a few 10 km cells across, in a projected CRS
+PROVINCE = Polygon([(1_000_300, 2_000_700), (1_052_000, 2_003_000), (1_047_500, 2_038_000),
+                    (1_021_000, 2_024_500), (1_004_000, 2_041_000)])
+
+
+def generate_grid(tmp_path, monkeypatch, polygon=PROVINCE):
+    monkeypatch.chdir(tmp_path)
+    gpd.GeoDataFrame({"PRENAME": ["Test"]}, geometry=[polygon], crs="EPSG:3978").to_file("canada.shp")
+    DCPShpGenerator("Test", "canada.shp").create_provincial_grid()
+    return gpd.read_file("Test/clippedGrid.shp")
+
+
+def test_locate_matches_sjoin(tmp_path, monkeypatch):
+    grid = generate_grid(tmp_path, monkeypatch)
+    rng = np.random.default_rng(0)
+    minx, miny, maxx, maxy = PROVINCE.bounds
+    points = gpd.GeoDataFrame(geometry=gpd.points_from_xy(rng.uniform(minx - 5000, maxx + 5000, 5000),
+                                                          rng.uniform(miny - 5000, maxy + 5000, 5000)), crs=grid.crs)
+
+    expected = gpd.sjoin(points, grid[["id", "geometry"]], how="left", predicate="within")["id"]
+    expected = expected.fillna(-1).astype(np.int64).to_numpy()
+    locator = DCPGridLocator.load_or_build("Test")
+    assert np.array_equal(locator.locate(points.geometry.x, points.geometry.y), expected)
+    assert (expected >= 0).any() and (expected < 0).any()
+
+
+def test_regenerated_grid_replaces_the_saved_locator(tmp_path, monkeypatch):
+    generate_grid(tmp_path, monkeypatch)
+    first = DCPGridLocator.load_or_build("Test").lookup
+
+    # A smaller province in the same directory: the grid is rewritten and the locator must follow it
+    os.remove("Test/Province.shp")
+    grid = generate_grid(tmp_path, monkeypatch, PROVINCE.buffer(-8000))
+    lookup = DCPGridLocator.load_or_build("Test").lookup
+    assert lookup.shape != first.shape or not np.array_equal(lookup, first)
+    assert np.array_equal(np.sort(lookup[lookup >= 0]), np.sort(grid["id"].to_numpy()))
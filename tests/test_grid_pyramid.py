@@ -0,0 +1,41 @@
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from shapely.geometry import Polygon
+from DCPDatacube import DCPDatacube
+from DCPGridPyramid import DCPGridPyramid
+
+
+def test_corner_contact_is_dropped_and_levels_are_mapped(tmp_path):
+    # L-shaped province whose notch touches the 20 m lattice cell at (20, 20) only at its corner
+    province = gpd.GeoDataFrame(geometry=[Polygon([(0, 0), (40, 0), (40, 20), (20, 20), (20, 40), (0, 40)])],
+                                crs="EPSG:3978")
+    pyramid = DCPGridPyramid(str(tmp_path))
+    grids = pyramid.build(province, [10, 20])
+
+    assert (grids[10].geom_type == "Polygon").all() and (grids[20].geom_type == "Polygon").all()
+    assert len(grids[10]) == 12 and len(grids[20]) == 3
+    mapping = pyramid.load_mapping()
+    col, row = np.divmod(mapping["id"].to_numpy(), 4)
+    assert np.array_equal(mapping["id_20"].to_numpy(), (col // 2) * 2 + row // 2)
+    assert pyramid.has_levels([10, 20]) and not pyramid.has_levels([10, 20, 40])
+    assert not DCPGridPyramid(f"{tmp_path}/missing").has_levels([10, 20])
+
+
+def test_aggregators():
+    ids = np.arange(4)
+    cube = DCPDatacube(ids, pd.date_range("2020-07-01", periods=1))
+    cube.add_feature("Wd", ids, np.array([[350.0], [10.0], [90.0], [np.nan]]))
+    cube.add_feature("Fires_1y", ids, np.array([[1.0], [2.0], [np.nan], [np.nan]]))
+    cube.add_feature("ignition", ids, np.array([[0.0], [1.0], [0.0], [0.0]]))
+    cube.add_feature("T", ids, np.array([[1.0], [3.0], [5.0], [np.nan]]))
+    mapping = pd.DataFrame({"id": ids, "area": [1.0, 3.0, 1.0, 1.0], "id_20": [0, 0, 1, 1]})
+
+    coarse = DCPGridPyramid(".").aggregate_cube(cube, 20, mapping)
+    values = {column: array[:, 0] for column, (array, _) in coarse.features.items()}
+    assert np.allclose(values["Wd"], [np.degrees(np.arctan2(np.sin(np.radians(350)) + 3 * np.sin(np.radians(10)),
+                                                             np.cos(np.radians(350)) + 3 * np.cos(np.radians(10)))),
+                                      90])
+    assert np.allclose(values["Fires_1y"][0], 3) and np.isnan(values["Fires_1y"][1])
+    assert np.array_equal(values["ignition"], [1, 0])
+    assert np.allclose(values["T"], [2.5, 5])
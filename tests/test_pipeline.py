@@ -0,0 +1,62 @@
+import threading
+import time
+import pytest
+from DCPPipeline import DCPPipeline
+
+
+def test_results_keep_item_order():
+    # Later items finish first, results still follow the items
+    def fetch(item):
+        time.sleep(0.001 * (10 - item))
+        return item * 10
+
+    def process(item, fetched):
+        time.sleep(0.002 * (10 - item))
+        return item, fetched
+
+    pipeline = DCPPipeline(fetch, process, depth=3, fetchers=2, workers=3)
+    assert pipeline.run(range(10)) == [(item, item * 10) for item in range(10)]
+    assert pipeline.run([]) == []
+
+
+def test_depth_bounds_items_in_flight():
+    lock = threading.Lock()
+    in_flight, peak = [0], [0]
+
+    def fetch(item):
+        with lock:
+            in_flight[0] += 1
+            peak[0] = max(peak[0], in_flight[0])
+        return item
+
+    def process(item, fetched):
+        time.sleep(0.005)
+        with lock:
+            in_flight[0] -= 1
+        return fetched
+
+    assert DCPPipeline(fetch, process, depth=2, fetchers=2, workers=4).run(range(12)) == list(range(12))
+    assert peak[0] <= 2
+
+
+@pytest.mark.parametrize("stage", ["fetch", "process"])
+def test_errors_reach_the_caller(stage):
+    fetched = []
+
+    def fetch(item):
+        if stage == "fetch" and item == 3:
+            raise ValueError("fetch failed")
+        fetched.append(item)
+        return item
+
+    def process(item, value):
+        if stage == "process" and item == 3:
+            raise ValueError("process failed")
+        return value
+
+    with pytest.raises(ValueError, match=f"{stage} failed"):
+        DCPPipeline(fetch, process, depth=2).run(range(50))
+    if stage == "fetch":
+        # Fetchers stop instead of downloading the rest of the items
+        time.sleep(0.05)
+        assert len(fetched) < 50
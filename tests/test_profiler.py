@@ -0,0 +1,36 @@
+import os
+import json
+from DCPProfiler import DCPProfiler
+
+
+def test_nested_stages_record_their_parent_and_profile_once(tmp_path):
+    profiler = DCPProfiler(str(tmp_path), cprofile_stages=["*"])
+    with profiler.stage("export"):
+        with profiler.stage("era5_sample") as inner:
+            inner.add_rows(10)
+            sum(range(1000))
+    profiler.save()
+
+    stages = {record.name: record for record in profiler.stages}
+    assert stages["era5_sample"].parent == "export"
+    assert stages["export"].parent is None
+    assert stages["era5_sample"].rows == 10
+    # Only the outer stage holds the profiler; the inner one runs unprofiled instead of failing
+    assert os.path.exists(f"{tmp_path}/profile_export.prof")
+    assert not os.path.exists(f"{tmp_path}/profile_era5_sample.prof")
+    assert DCPProfiler._active_profile is None
+
+    with open(f"{tmp_path}/run_report.json") as f:
+        report = json.load(f)
+    assert report["peak_rss_mb"] > 0
+    assert {record["stage"] for record in report["stages"]} == {"export", "era5_sample"}
+
+
+def test_peak_rss_does_not_drop():
+    profiler = DCPProfiler(enabled=False)
+    before = profiler.peak_rss_mb()
+    block = bytearray(64 * 2 ** 20)
+    during = profiler.peak_rss_mb()
+    del block
+    assert during >= before
+    assert profiler.peak_rss_mb() >= during